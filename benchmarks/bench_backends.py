@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+输出后端基准: 在独立进程中分别用默认后端 (python-docx 文档树) 与流式后端
+转换同一文档, 比较耗时与峰值内存, 并校验两者生成的 .docx 各部件完全一致
+
+用法:
+    python benchmarks/bench_backends.py [--paragraphs N] [文件.md ...]
+未指定文件时生成 N 段 (默认 20000) 含行内公式的 Markdown。
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import zipfile
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+
+CHILD = r'''
+import json, resource, sys, time
+sys.path.insert(0, sys.argv[1])
+import md2docx
+start = time.perf_counter()
+md2docx.convert_md_to_docx(sys.argv[2], sys.argv[3], streaming=sys.argv[4] == '1')
+print(json.dumps({'time': time.perf_counter() - start,
+                  'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+'''
+
+def make_markdown(n):
+    lines = []
+    for i in range(n):
+        if i % 100 == 0:
+            lines.append(f'## 第 {i // 100} 节')
+        else:
+            lines.append(f'第 {i} 段含公式 $x_{{{i % 50}}}^2 + \\alpha$ 与 θ_t, 以及 **加粗** 文本。')
+        lines.append('')
+    return '\n'.join(lines)
+
+def run(src, out, streaming):
+    proc = subprocess.run([sys.executable, '-c', CHILD, str(REPO), str(src), str(out),
+                           '1' if streaming else '0'],
+                          capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def same_parts(a, b):
+    with zipfile.ZipFile(a) as za, zipfile.ZipFile(b) as zb:
+        names = za.namelist()
+        return names == zb.namelist() and all(za.read(n) == zb.read(n) for n in names)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--paragraphs', type=int, default=20000)
+    parser.add_argument('files', nargs='*')
+    args = parser.parse_args()
+
+    status = 0
+    with tempfile.TemporaryDirectory() as tmpdir:
+        files = [Path(f) for f in args.files]
+        if not files:
+            files = [Path(tmpdir) / f'generated_{args.paragraphs}.md']
+            files[0].write_text(make_markdown(args.paragraphs), encoding='utf-8')
+        for src in files:
+            docx_out = Path(tmpdir) / 'docx.docx'
+            stream_out = Path(tmpdir) / 'stream.docx'
+            a = run(src, docx_out, False)
+            b = run(src, stream_out, True)
+            same = same_parts(docx_out, stream_out)
+            status |= not same
+            # ru_maxrss 在 Linux 上以 KB 为单位
+            print(f"{src.name}: 输出{'一致' if same else '不一致'}")
+            print(f"  python-docx: {a['time']:7.2f}s  峰值内存 {a['rss'] / 1024:7.1f} MB")
+            print(f"  流式后端:    {b['time']:7.2f}s  峰值内存 {b['rss'] / 1024:7.1f} MB")
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
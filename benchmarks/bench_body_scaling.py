@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+正文构建规模基准: 分别用 python-docx 的 doc.add_paragraph 与 BodyBuilder
+追加 N 个段落, 并对生成的 N 段 Markdown 做端到端转换, 观察耗时是否随 N 线性增长
+
+用法:
+    python benchmarks/bench_body_scaling.py [--sizes 1000 10000 100000] [--docx-limit N]
+python-docx 的追加是平方级的, 超过 --docx-limit (默认 10000) 的规模不再测它。
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+
+import md2docx  # noqa: E402
+
+def append_paragraphs(target, n):
+    start = time.perf_counter()
+    for i in range(n):
+        target.add_paragraph(f'第 {i} 段普通文本, 用于测量正文追加的耗时。')
+    return time.perf_counter() - start
+
+def make_markdown(n):
+    lines = []
+    for i in range(n):
+        if i % 50 == 0:
+            lines.append(f'## 第 {i // 50} 节')
+        elif i % 10 == 0:
+            lines.append(f'- 列表项 {i}')
+        else:
+            lines.append(f'第 {i} 段普通文本, 用于测量正文追加的耗时。')
+        lines.append('')
+    return '\n'.join(lines)
+
+def convert(n, tmpdir):
+    src = Path(tmpdir) / f'body_{n}.md'
+    src.write_text(make_markdown(n), encoding='utf-8')
+    start = time.perf_counter()
+    md2docx.convert_md_to_docx(src, src.with_suffix('.docx'))
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--docx-limit', type=int, default=10000,
+                        help='python-docx 基线的最大规模 (默认 10000)')
+    args = parser.parse_args()
+
+    print(f"{'段落数':>8} {'python-docx':>12} {'BodyBuilder':>12} {'端到端转换':>12} {'us/段':>8}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for n in args.sizes:
+            if n <= args.docx_limit:
+                baseline = f'{append_paragraphs(md2docx.Document(), n):11.2f}s'
+            else:
+                baseline = f"{'-':>12}"
+            built = append_paragraphs(md2docx.BodyBuilder(md2docx.Document()), n)
+            total = convert(n, tmpdir)
+            print(f'{n:>8} {baseline} {built:11.2f}s {total:11.2f}s {total * 1e6 / n:8.1f}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
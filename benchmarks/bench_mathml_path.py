@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+MathML 路径基准: 对比"MathML 字符串 → etree.fromstring"旧路径与
+直接使用 latex2mathml 元素树的新路径, 并逐个校验两者生成的 OMML 完全一致
+
+用法:
+    python benchmarks/bench_mathml_path.py [--repeat N] [文件.md ...]
+未指定文件时使用 examples/sample.md 中的公式。
+"""
+import argparse
+import re
+import sys
+import time
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+
+import md2docx  # noqa: E402
+from lxml import etree  # noqa: E402
+import latex2mathml.converter  # noqa: E402
+
+FORMULA_RE = re.compile(r'\$\$(.+?)\$\$|\$([^$\n]+)\$', re.S)
+
+def extract_formulas(paths):
+    formulas = []
+    for path in paths:
+        text = Path(path).read_text(encoding='utf-8')
+        for m in FORMULA_RE.finditer(text):
+            latex = md2docx.normalize_latex(m.group(1) or m.group(2))
+            if latex:
+                formulas.append(md2docx.preprocess_latex(latex))
+    return formulas
+
+def string_path(latex):
+    mathml_str = latex2mathml.converter.convert(latex)
+    return md2docx.mathml_to_omml(etree.fromstring(mathml_str.encode('utf-8')))
+
+def tree_path(latex):
+    return md2docx.mathml_to_omml(md2docx.latex_to_mathml_tree(latex))
+
+def run(func, formulas, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for latex in formulas:
+            func(latex)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=50, help='重复次数 (默认 50)')
+    parser.add_argument('files', nargs='*', default=[REPO / 'examples' / 'sample.md'])
+    args = parser.parse_args()
+
+    formulas = []
+    mismatches = 0
+    for latex in extract_formulas(args.files):
+        try:
+            expected = etree.tostring(string_path(latex))
+        except Exception:
+            continue  # 旧路径无法转换的公式不参与比较与计时
+        formulas.append(latex)
+        if etree.tostring(tree_path(latex)) != expected:
+            mismatches += 1
+            print(f"输出不一致: {latex}")
+    print(f"公式数: {len(formulas)}, 输出不一致: {mismatches}")
+    if not formulas:
+        return 0
+
+    calls = len(formulas) * args.repeat
+    old = run(string_path, formulas, args.repeat)
+    new = run(tree_path, formulas, args.repeat)
+    print(f"字符串往返: {old * 1e6 / calls:8.1f} us/公式")
+    print(f"直接元素树: {new * 1e6 / calls:8.1f} us/公式  ({old / new:.2f}x)")
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
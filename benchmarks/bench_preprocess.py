@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+LaTeX 预处理基准: 对比旧版逐项 re.sub / str.replace 的预处理与单次扫描的
+preprocess_latex, 并逐个校验两者输出完全一致 (含字体命令互相嵌套的情形)
+
+旧版运算符名用 str.replace 替换, 会把 \\clipboard 改写为 \\operatorname{clip}board;
+这里的参考实现只替换完整的命令名, 与现行行为一致, 其余步骤与旧版相同。
+旧版删去 \\mathbb / \\mathcal 的 } 后才替换运算符名与汉字, 被删去的 } 两侧会连成
+一个词 (如 "中}文" 成为一段 \\text, "\\clip}x" 成为 \\clipx); 单次扫描按原文的
+词界处理。除此之外 (含括号不配对的输入) 两者输出相同。
+
+用法:
+    python benchmarks/bench_preprocess.py [--repeat N] [文件.md ...]
+未指定文件时使用 examples/sample.md 中的公式与合成语料。
+"""
+import argparse
+import re
+import sys
+import time
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+sys.path.insert(0, str(REPO / 'benchmarks'))
+
+import md2docx  # noqa: E402
+from corpus import generate_corpus  # noqa: E402
+
+FORMULA_RE = re.compile(r'\$\$(.+?)\$\$|\$([^$\n]+)\$', re.S)
+
+# 字体命令嵌套、相邻与括号不配对等容易出错的情形
+EDGE_CASES = [
+    r'x \in \mathbb{\mathcal{R}}',
+    r'\mathcal{\mathbb{R}}',
+    r'\mathbf{\text{a}}',
+    r'\text{if \mathbf{w}}',
+    r'\text{a \text{b}} + \text{c}',
+    r'\mathbb{\mathbb{R}}^n',
+    r'\mathbb{\text{R}}',
+    r'\mathcal{\text{a}} \mathcal{b}',
+    r'\mathbb{x_{i}} + \mathcal{L}_{\mathbb{E}}',
+    r'\mathbf{W}^{\text{T}} \mathbf{x_{t}}',
+    r'\text{损失 \mathbf{L}} = \softmax(x)',
+    r'\mathbb{E}_{s \sim \pi}[\text{奖励}]',
+    r'\mathbb{R',
+    r'\text{open',
+    r'}\mathcal{a}}}',
+    r'\clip \clipboard \ReLU(x) \mathrm{softmax}',
+]
+
+OPERATORS = ['softmax', 'clip', 'Attention', 'MultiHead', 'Concat', 'AGG',
+             'ActualSaving', 'ExpectedSaving', 'ComfortViolation', 'SafetyViolation',
+             'CLIP', 'VF', 'ReLU', 'sigmoid', 'tanh', 'argmax', 'argmin']
+
+def reference_preprocess(latex_str):
+    """旧版预处理 (运算符名只匹配完整命令名)"""
+    s = latex_str.strip()
+    s = re.sub(r'\\text\{([^}]*)\}', r'\\mathrm{\1}', s)
+    s = re.sub(r'\\mathbf\{([^}]*)\}', r'\\mathrm{\1}', s)
+    s = re.sub(r'\\mathbb\{([^}]*)\}', r'\1', s)
+    s = re.sub(r'\\mathcal\{([^}]*)\}', r'\1', s)
+    for func in OPERATORS:
+        s = re.sub(rf'\\{func}(?![A-Za-z])', lambda m, f=func: f'\\operatorname{{{f}}}', s)
+    s = re.sub(r'([\u4e00-\u9fff]+)', r'\\text{\1}', s)
+    return s
+
+def extract_formulas(texts):
+    formulas = []
+    for text in texts:
+        for m in FORMULA_RE.finditer(text):
+            latex = md2docx.normalize_latex(m.group(1) or m.group(2))
+            if latex:
+                formulas.append(latex)
+    return formulas
+
+def run(func, formulas, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for latex in formulas:
+            func(latex)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20, help='重复次数 (默认 20)')
+    parser.add_argument('files', nargs='*')
+    args = parser.parse_args()
+
+    if args.files:
+        texts = [Path(path).read_text(encoding='utf-8') for path in args.files]
+    else:
+        texts = [(REPO / 'examples' / 'sample.md').read_text(encoding='utf-8'),
+                 generate_corpus(paragraphs=2000)]
+    formulas = EDGE_CASES + extract_formulas(texts)
+
+    md2docx.configure_latex()
+    mismatches = 0
+    for latex in formulas:
+        expected = reference_preprocess(latex)
+        actual = md2docx.preprocess_latex(latex)
+        if actual != expected:
+            mismatches += 1
+            print(f"输出不一致: {latex}\n  旧版: {expected}\n  现行: {actual}")
+    print(f"公式数: {len(formulas)}, 输出不一致: {mismatches}")
+
+    calls = len(formulas) * args.repeat
+    old = run(reference_preprocess, formulas, args.repeat)
+    new = run(md2docx.preprocess_latex, formulas, args.repeat)
+    print(f"逐项替换: {old * 1e6 / calls:8.2f} us/公式")
+    print(f"单次扫描: {new * 1e6 / calls:8.2f} us/公式  ({old / new:.2f}x)")
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+启动时间基准: 在新的 Python 进程中测量冷启动耗时
+- import: 仅 `import md2docx` (作为库使用时的开销)
+- cli-text: 命令行转换不含公式的小文件
+- cli-math: 命令行转换含少量公式的小文件
+
+用法:
+    python benchmarks/bench_startup.py [--runs N] [--against 旧版md2docx.py]
+例如与上一个提交对比:
+    git show HEAD~1:md2docx.py > /tmp/md2docx_old.py
+    python benchmarks/bench_startup.py --against /tmp/md2docx_old.py
+"""
+import argparse
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+
+TEXT_MD = """# 标题
+
+## 第一节
+
+这是一个没有公式的普通段落。
+
+- 项目一
+- 项目二
+"""
+
+MATH_MD = """# 标题
+
+质能方程 $E = mc^2$ 与参数 θ。
+
+$$\\frac{a}{b} + \\sum_{i=1}^{n} x_i$$
+"""
+
+def time_command(cmd, runs, cwd):
+    """返回多次运行的耗时列表 (毫秒)"""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=cwd, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+def bench_script(script, runs, workdir):
+    """对一个 md2docx.py 运行全部启动场景"""
+    target = workdir / script.stem
+    target.mkdir()
+    shutil.copy(script, target / 'md2docx.py')
+    (target / 'text.md').write_text(TEXT_MD, encoding='utf-8')
+    (target / 'math.md').write_text(MATH_MD, encoding='utf-8')
+
+    py = sys.executable
+    cases = {
+        'import': [py, '-c', 'import md2docx'],
+        'cli-text': [py, 'md2docx.py', 'text.md'],
+        'cli-math': [py, 'md2docx.py', 'math.md'],
+    }
+    results = {name: time_command(cmd, runs, target) for name, cmd in cases.items()}
+
+    probe = subprocess.run(
+        [py, '-c', 'import sys, md2docx; '
+                   'print(",".join(m for m in ("tkinter", "docx", "lxml", "latex2mathml") '
+                   'if m in sys.modules) or "-")'],
+        cwd=target, check=True, capture_output=True, text=True)
+    return results, probe.stdout.strip()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='每个场景运行次数 (默认 10)')
+    parser.add_argument('--against', type=Path, help='用于对比的另一份 md2docx.py')
+    args = parser.parse_args()
+
+    scripts = [('current', REPO / 'md2docx.py')]
+    if args.against:
+        scripts.append(('against', args.against.resolve()))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, script in scripts:
+            workdir = Path(tmp) / label
+            workdir.mkdir()
+            results, loaded = bench_script(script, args.runs, workdir)
+            print(f"{label}: {script}")
+            print(f"  import 后已加载的重量级模块: {loaded}")
+            for name, samples in results.items():
+                print(f"  {name:9s} median {statistics.median(samples):7.1f} ms"
+                      f"   min {min(samples):7.1f} ms")
+
+if __name__ == '__main__':
+    main()
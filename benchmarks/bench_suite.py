@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+基准测试套件: 用合成语料 (benchmarks/corpus.py) 测量端到端转换与各环节的耗时,
+结果写成 JSON, 并可与基线文件比较, 标出变慢超过阈值的项目
+
+- e2e/*:    convert_md_to_docx 端到端 (不同类型的语料, 每次都清空公式缓存)
+- micro/*:  latex_to_omml (未缓存/缓存命中)、identify_math_in_text、
+            text_to_latex、表格构建 add_markdown_table
+
+用法:
+    python benchmarks/bench_suite.py [--quick] [--filter 名称片段] [--output 结果.json]
+    python benchmarks/bench_suite.py --baseline benchmarks/baseline.json [--threshold 0.2]
+    python benchmarks/bench_suite.py --save-baseline benchmarks/baseline.json
+与基线比较时, 任一项目比基线慢 threshold (默认 20%) 以上即以退出码 1 结束。
+基线只在同一台机器、同一环境下才有可比性。
+"""
+import argparse
+import gc
+import itertools
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+REPO = HERE.parent
+sys.path.insert(0, str(REPO))
+sys.path.insert(0, str(HERE))
+
+import md2docx  # noqa: E402
+from corpus import BARE_MATH, INLINE_TEMPLATES, generate_corpus  # noqa: E402
+
+# 端到端语料: 名称 -> generate_corpus 参数 (--quick 时段落数缩小为 1/5)
+E2E_CORPORA = {
+    'mixed': dict(paragraphs=2000),
+    'formula-heavy': dict(paragraphs=1000, formula_density=3, unique_ratio=0.9,
+                          block_formula_ratio=0.2),
+    'table-heavy': dict(paragraphs=1000, formula_density=0.2, table_every=10,
+                        table_rows=20, table_cols=6),
+    'plain-cjk': dict(paragraphs=5000, formula_density=0, block_formula_ratio=0,
+                      bare_math_ratio=0, table_every=0, cjk_ratio=1.0),
+    'latin-bullets': dict(paragraphs=3000, formula_density=0.3, bullet_ratio=0.6,
+                          cjk_ratio=0.0),
+}
+
+def measure(func, repeat, min_time=0.2):
+    """返回 func 单次调用耗时的最小值 (秒): 先确定每轮调用次数, 再取 repeat 轮中最快的一轮
+
+    与 timeit 一样, 计时期间关闭垃圾回收以减少抖动。
+    """
+    gc.collect()
+    gc.disable()
+    try:
+        return _measure(func, repeat, min_time)
+    finally:
+        gc.enable()
+
+def _measure(func, repeat, min_time):
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+def bench_e2e(wanted, tmpdir, quick, repeat):
+    for name, options in E2E_CORPORA.items():
+        if not wanted(f'e2e/{name}'):
+            continue
+        options = dict(options)
+        if quick:
+            options['paragraphs'] //= 5
+        src = Path(tmpdir) / f'{name}.md'
+        src.write_text(generate_corpus(**options), encoding='utf-8')
+        out = src.with_suffix('.docx')
+
+        def convert():
+            md2docx.FORMULA_CACHE.clear()
+            md2docx.convert_md_to_docx(src, out)
+        yield f'e2e/{name}', measure(convert, repeat, min_time=0), \
+            {'paragraphs': options['paragraphs'], 'bytes': src.stat().st_size}
+
+def bench_micro(wanted, repeat):
+    rng = random.Random(0)
+    formulas = [t.format(i=rng.randint(1, 99), j=rng.randint(1, 9), n=rng.randint(2, 999))
+                for t in INLINE_TEMPLATES for _ in range(5)]
+
+    def uncached():
+        md2docx.FORMULA_CACHE.clear()
+        for latex in formulas:
+            md2docx.latex_to_omml(latex)
+    if wanted('micro/latex_to_omml_uncached'):
+        yield 'micro/latex_to_omml_uncached', measure(uncached, repeat) / len(formulas), \
+            {'unit': 'formula'}
+
+    def cached():
+        for latex in formulas:
+            md2docx.latex_to_omml(latex)
+    if wanted('micro/latex_to_omml_cached'):
+        cached()
+        yield 'micro/latex_to_omml_cached', measure(cached, repeat) / len(formulas), \
+            {'unit': 'formula'}
+
+    text = generate_corpus(paragraphs=200, formula_density=0, block_formula_ratio=0,
+                           bare_math_ratio=0.5, table_every=0, seed=1).splitlines()
+    lines = [line for line in text if line and not line.startswith('#')]
+
+    def identify():
+        for line in lines:
+            md2docx.identify_math_in_text(line)
+    if wanted('micro/identify_math_in_text'):
+        yield 'micro/identify_math_in_text', measure(identify, repeat) / len(lines), \
+            {'unit': 'line'}
+
+    def to_latex():
+        for expr in BARE_MATH:
+            md2docx.text_to_latex(expr)
+    if wanted('micro/text_to_latex'):
+        yield 'micro/text_to_latex', measure(to_latex, repeat) / len(BARE_MATH), \
+            {'unit': 'expression'}
+
+    rows = [[f'列{c}' for c in range(6)]]
+    rows += [[f'${formulas[(r + c) % len(formulas)]}$' if c == 0 else str(r * 6 + c)
+              for c in range(6)] for r in range(50)]
+    doc = md2docx.new_document()
+    body = md2docx.BodyBuilder(doc)
+    stats = {'block': 0, 'inline': 0, 'cache_hits': 0, 'disk_hits': 0, 'cache_misses': 0}
+
+    def table():
+        md2docx.add_markdown_table(body, rows, stats)
+    if wanted('micro/add_markdown_table_50x6'):
+        yield 'micro/add_markdown_table_50x6', measure(table, repeat), {'unit': 'table'}
+
+def environment():
+    import latex2mathml
+    import lxml
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'lxml': lxml.__version__,
+        'latex2mathml': getattr(latex2mathml, '__version__', None),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+def compare(results, baseline, threshold):
+    """打印与基线的比较, 返回变慢超过阈值的项目名"""
+    regressions = []
+    for name, entry in results.items():
+        old = baseline.get('results', {}).get(name)
+        if old is None:
+            continue
+        ratio = entry['seconds'] / old['seconds']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  <-- 变慢'
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = '  (变快)'
+        print(f"  {name:36s} {ratio:6.2f}x{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='缩小端到端语料, 快速检查')
+    parser.add_argument('--repeat', type=int, default=5, help='每项重复轮数, 取最快 (默认 5)')
+    parser.add_argument('--filter', default='', help='只运行名称包含该片段的项目')
+    parser.add_argument('--output', help='把结果写入 JSON 文件')
+    parser.add_argument('--baseline', help='与该基线文件比较')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='判为变慢的相对阈值 (默认 0.2)')
+    parser.add_argument('--save-baseline', metavar='PATH', help='把结果保存为新的基线')
+    args = parser.parse_args()
+
+    def wanted(name):
+        return args.filter in name
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, seconds, info in itertools.chain(
+                bench_e2e(wanted, tmpdir, args.quick, args.repeat),
+                bench_micro(wanted, args.repeat)):
+            results[name] = dict(seconds=seconds, **info)
+            print(f"{name:38s} {seconds * 1e3:10.3f} ms")
+
+    report = {'environment': environment(), 'quick': args.quick, 'results': results}
+    for path in (args.output, args.save_baseline):
+        if path:
+            Path(path).write_text(json.dumps(report, ensure_ascii=False, indent=2) + '\n',
+                                  encoding='utf-8')
+            print(f"结果已写入: {path}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8'))
+        if baseline.get('quick') != args.quick:
+            print("注意: 基线与本次运行的 --quick 设置不同, 端到端结果不可比")
+        print(f"与基线比较 ({args.baseline}):")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} 项比基线慢 {args.threshold:.0%} 以上: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+合成 Markdown 语料生成器: 同样的参数与随机种子总是生成同样的文档,
+可分别调整规模、公式密度、表格大小、项目符号比例与中英文比例
+
+用法:
+    python benchmarks/corpus.py 输出.md [--paragraphs N] [--formula-density F] ...
+也可在其他基准中 `from corpus import generate_corpus` 直接生成文本。
+"""
+import argparse
+import random
+import sys
+from pathlib import Path
+
+CJK_PHRASES = [
+    '在强化学习中', '策略梯度方法', '通过最大化期望回报', '价值函数的估计',
+    '我们可以得到', '其中参数更新为', '注意力机制', '每一层的输出', '损失函数定义为',
+    '实验结果表明', '该方法收敛更快', '对于任意状态', '由上式可知', '模型的泛化能力',
+]
+LATIN_WORDS = [
+    'the', 'policy', 'gradient', 'estimates', 'expected', 'return', 'while', 'value',
+    'function', 'converges', 'under', 'mild', 'assumptions', 'for', 'each', 'layer',
+    'attention', 'weights', 'are', 'normalized', 'results', 'show', 'faster', 'training',
+]
+# 行内公式模板, {i} {j} {n} 为随机整数
+INLINE_TEMPLATES = [
+    r'x_{{{i}}}^{{{j}}}',
+    r'\frac{{a_{{{i}}} + b}}{{c^{{{j}}}}}',
+    r'\sum_{{k=1}}^{{{n}}} k^{{{j}}}',
+    r'\sqrt{{x^2 + {n}}}',
+    r'\alpha_{{{i}}} \cdot \beta^{{{j}}}',
+    r'\mathbb{{E}}_{{s \sim \pi}}[R_{{{i}}}]',
+    r'\theta_{{t+{i}}} = \theta_t - \eta \nabla L',
+    r'e^{{-{i}x}} \le {n}',
+]
+BLOCK_TEMPLATES = [
+    r'\int_0^{{{n}}} e^{{-{i}x^2}} dx = \frac{{\sqrt{{\pi}}}}{{{j}}}',
+    r'A_{{{i}}} = \begin{{pmatrix}} {i} & {j} \\ {n} & 1 \end{{pmatrix}}',
+    r'L(\theta) = \sum_{{t=0}}^{{{n}}} \gamma^t r_{{t+{i}}} - \lambda \|\theta\|^{{{j}}}',
+    r'\hat{{y}}_{{{i}}} = \mathrm{{softmax}}\left(\frac{{QK^T}}{{\sqrt{{d_{{{j}}}}}}}\right)V',
+]
+BARE_MATH = ['θ_t', 'π_θ(a|s)', 'α', 'h_i', 'W^T', 'x_t', 'f(x)', 'γ', 'λ_{max}', 'x₁ ∈ X']
+
+def _formula(rng, templates, unique_ratio, pool):
+    """按 unique_ratio 的概率生成新公式, 否则复用之前出现过的公式"""
+    if pool and rng.random() >= unique_ratio:
+        return rng.choice(pool)
+    latex = rng.choice(templates).format(i=rng.randint(1, 99), j=rng.randint(1, 9),
+                                         n=rng.randint(2, 999))
+    pool.append(latex)
+    return latex
+
+def _sentence(rng, cjk_ratio):
+    if rng.random() < cjk_ratio:
+        return '，'.join(rng.sample(CJK_PHRASES, 3)) + '。'
+    words = rng.sample(LATIN_WORDS, 8)
+    return ' '.join(words).capitalize() + '.'
+
+def generate_corpus(paragraphs=1000, formula_density=0.5, unique_ratio=0.5,
+                    block_formula_ratio=0.05, bare_math_ratio=0.2,
+                    table_every=50, table_rows=8, table_cols=4, table_formula_ratio=0.2,
+                    bullet_ratio=0.1, cjk_ratio=0.7, section_every=40, seed=0):
+    """生成合成 Markdown 文本
+
+    paragraphs 段落数 (含项目符号); formula_density 每段平均行内公式数;
+    unique_ratio 公式为新公式 (而非重复出现) 的概率; block_formula_ratio 段后
+    跟一个 $$ 公式块的概率; bare_math_ratio 段内含裸数学表达式的概率;
+    每 table_every 段插入一个 table_rows × table_cols 的表格 (0 表示不插入),
+    其中单元格为公式的概率为 table_formula_ratio; bullet_ratio 项目符号的比例;
+    cjk_ratio 中文句子的比例; 每 section_every 段一个二级标题。
+    """
+    rng = random.Random(seed)
+    inline_pool, block_pool = [], []
+    lines = ['# 合成基准文档', '']
+
+    for n in range(paragraphs):
+        if section_every and n % section_every == 0:
+            lines += [f'## 第 {n // section_every + 1} 节', '']
+
+        parts = [_sentence(rng, cjk_ratio)]
+        # 公式个数取期望为 formula_density 的二项分布近似
+        count = int(formula_density) + (rng.random() < formula_density % 1)
+        for _ in range(count):
+            parts.append(f'${_formula(rng, INLINE_TEMPLATES, unique_ratio, inline_pool)}$')
+            parts.append(_sentence(rng, cjk_ratio))
+        if rng.random() < bare_math_ratio:
+            parts.append(f'参数 {rng.choice(BARE_MATH)} 满足条件。')
+        text = ' '.join(parts)
+
+        if rng.random() < bullet_ratio:
+            lines.append(f'- {text}')
+        else:
+            lines += [text, '']
+
+        if rng.random() < block_formula_ratio:
+            lines += ['$$', _formula(rng, BLOCK_TEMPLATES, unique_ratio, block_pool), '$$', '']
+
+        if table_every and (n + 1) % table_every == 0:
+            lines.append('| ' + ' | '.join(f'列{c + 1}' for c in range(table_cols)) + ' |')
+            lines.append('|' + '---|' * table_cols)
+            for r in range(table_rows):
+                cells = []
+                for c in range(table_cols):
+                    if rng.random() < table_formula_ratio:
+                        cells.append(f'${_formula(rng, INLINE_TEMPLATES, unique_ratio, inline_pool)}$')
+                    else:
+                        cells.append(f'{r * table_cols + c}')
+                lines.append('| ' + ' | '.join(cells) + ' |')
+            lines.append('')
+
+    return '\n'.join(lines) + '\n'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('output')
+    parser.add_argument('--paragraphs', type=int, default=1000)
+    parser.add_argument('--formula-density', type=float, default=0.5)
+    parser.add_argument('--unique-ratio', type=float, default=0.5)
+    parser.add_argument('--block-formula-ratio', type=float, default=0.05)
+    parser.add_argument('--bare-math-ratio', type=float, default=0.2)
+    parser.add_argument('--table-every', type=int, default=50)
+    parser.add_argument('--table-rows', type=int, default=8)
+    parser.add_argument('--table-cols', type=int, default=4)
+    parser.add_argument('--bullet-ratio', type=float, default=0.1)
+    parser.add_argument('--cjk-ratio', type=float, default=0.7)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    options = vars(args).copy()
+    output = Path(options.pop('output'))
+    output.write_text(generate_corpus(**options), encoding='utf-8')
+    print(f"已生成: {output} ({output.stat().st_size / 1024:.1f} KB)")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
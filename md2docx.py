@@ -4,22 +4,82 @@ MD2DOCX - Markdown to Word Converter with Formula Support
 将Markdown文档转换为Word文档，公式自动转换为公式编辑器格式
 支持: 拖放文件到exe / 命令行参数 / 双击后选择文件
 """
+import io
 import re
 import sys
 import os
+import copy
+import glob
+import time
+import types
+import atexit
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
 from pathlib import Path
 
-# GUI for file selection
-import tkinter as tk
-from tkinter import filedialog, messagebox
+# ===== Lazy Imports =====
+# 图形界面 (tkinter) 只在对话框路径导入; python-docx / lxml / latex2mathml
+# 等重量级依赖在首次使用时才导入, 使命令行启动与作为库导入都更快,
+# 也能在没有 Tk 的无界面服务器上运行。
+class _LazyImport:
+    """首次访问时调用 loader 导入, 并用真实对象替换本模块中的同名全局变量"""
+
+    def __init__(self, name, loader):
+        self._name = name
+        self._loader = loader
+
+    def _load(self):
+        obj = self._loader()
+        globals()[self._name] = obj
+        return obj
+
+    def __getattr__(self, item):
+        return getattr(self._load(), item)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+# 导入语句写在加载函数里而不是交给 importlib, PyInstaller 等打包工具才能找到这些依赖
+def _import_docx():
+    import docx
+    import docx.enum.style
+    import docx.enum.text
+    import docx.oxml
+    import docx.oxml.ns
+    import docx.oxml.table
+    import docx.shared
+    import docx.table
+    import docx.text.paragraph
+    return docx
+
+def _import_etree():
+    from lxml import etree
+    return etree
+
+def _import_latex2mathml():
+    from latex2mathml import converter
+    return converter
+
+def _import_sqlite3():
+    import sqlite3
+    return sqlite3
 
 # Document processing
-from docx import Document
-from docx.shared import Pt, Cm
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.oxml.ns import qn
-from lxml import etree
-import latex2mathml.converter
+Document = _LazyImport('Document', lambda: _import_docx().Document)
+Pt = _LazyImport('Pt', lambda: _import_docx().shared.Pt)
+Cm = _LazyImport('Cm', lambda: _import_docx().shared.Cm)
+Emu = _LazyImport('Emu', lambda: _import_docx().shared.Emu)
+WD_ALIGN_PARAGRAPH = _LazyImport('WD_ALIGN_PARAGRAPH', lambda: _import_docx().enum.text.WD_ALIGN_PARAGRAPH)
+qn = _LazyImport('qn', lambda: _import_docx().oxml.ns.qn)
+OxmlElement = _LazyImport('OxmlElement', lambda: _import_docx().oxml.OxmlElement)
+CT_Tbl = _LazyImport('CT_Tbl', lambda: _import_docx().oxml.table.CT_Tbl)
+Paragraph = _LazyImport('Paragraph', lambda: _import_docx().text.paragraph.Paragraph)
+Table = _LazyImport('Table', lambda: _import_docx().table.Table)
+WD_STYLE_TYPE = _LazyImport('WD_STYLE_TYPE', lambda: _import_docx().enum.style.WD_STYLE_TYPE)
+etree = _LazyImport('etree', _import_etree)
+latex2mathml_converter = _LazyImport('latex2mathml_converter', _import_latex2mathml)
+sqlite3 = _LazyImport('sqlite3', _import_sqlite3)
 
 # ===== OMML Namespace =====
 OMML_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/math'
@@ -29,65 +89,49 @@ NSMAP = {'m': OMML_NS, 'w': WORD_NS}
 def M(tag):
     return f'{{{OMML_NS}}}{tag}'
 
+def W(tag):
+    return f'{{{WORD_NS}}}{tag}'
+
 # ===== MathML to OMML Converter =====
+# 转换使用显式栈而非递归: 每个处理函数把生成的OMML节点直接追加到目标父节点,
+# 并把仍需转换的 (MathML子元素, OMML容器) 压栈。同一容器的子元素按逆序压栈,
+# 出栈顺序即文档顺序; 深层嵌套的公式 (大矩阵、多重分数) 不受递归深度限制。
+
 def mathml_to_omml(mathml_element):
     """将MathML元素转换为OMML元素"""
     oMathPara = etree.Element(M('oMathPara'), nsmap=NSMAP)
     oMath = etree.SubElement(oMathPara, M('oMath'))
-    for child in mathml_element:
-        converted = convert_element(child)
-        if converted is not None:
-            if isinstance(converted, list):
-                for item in converted:
-                    oMath.append(item)
-            else:
-                oMath.append(converted)
+    stack = []
+    push_children(mathml_element, oMath, stack)
+    _convert_stack(stack)
     return oMathPara
 
-def convert_element(elem):
-    """根据MathML元素类型进行转换"""
-    tag = etree.QName(elem.tag).localname if elem.tag else None
-    if tag is None:
-        return None
+def convert_element(elem, parent):
+    """把MathML元素 (含全部子孙) 转换后追加到OMML父节点"""
+    _convert_stack([(elem, parent)])
+
+def _convert_stack(stack):
+    converters = _CONVERTERS
+    pop = stack.pop
+    while stack:
+        elem, parent = pop()
+        tag = elem.tag
+        if not isinstance(tag, str):
+            continue
+        if tag[0] == '{':
+            tag = tag.rpartition('}')[2]
+        converter = converters.get(tag, push_children)
+        converter(elem, parent, stack)
 
-    converters = {
-        'mrow': convert_mrow, 'mi': convert_mi, 'mn': convert_mn,
-        'mo': convert_mo, 'mtext': convert_mtext, 'mfrac': convert_mfrac,
-        'msqrt': convert_msqrt, 'mroot': convert_mroot, 'msup': convert_msup,
-        'msub': convert_msub, 'msubsup': convert_msubsup, 'munder': convert_munder,
-        'mover': convert_mover, 'munderover': convert_munderover,
-        'mfenced': convert_mfenced, 'mtable': convert_mtable,
-        'mspace': convert_mspace, 'mstyle': convert_mstyle,
-        'mpadded': convert_mpadded, 'menclose': convert_menclose,
-    }
-
-    converter = converters.get(tag)
-    if converter:
-        return converter(elem)
-    else:
-        results = []
-        for child in elem:
-            converted = convert_element(child)
-            if converted is not None:
-                if isinstance(converted, list):
-                    results.extend(converted)
-                else:
-                    results.append(converted)
-        return results if results else None
-
-def convert_mrow(elem):
-    results = []
-    for child in elem:
-        converted = convert_element(child)
-        if converted is not None:
-            if isinstance(converted, list):
-                results.extend(converted)
-            else:
-                results.append(converted)
-    return results
+def _localname(tag):
+    return tag.rpartition('}')[2] if isinstance(tag, str) else None
 
-def create_run(text, italic=True):
-    r = etree.Element(M('r'))
+def push_children(elem, parent, stack):
+    """mrow / mstyle 等容器: 子元素直接展开到当前父节点"""
+    stack.extend([(child, parent) for child in reversed(elem)])
+
+def create_run(parent, text, italic=True):
+    r = etree.SubElement(parent, M('r'))
     if not italic:
         rPr = etree.SubElement(r, M('rPr'))
         sty = etree.SubElement(rPr, M('sty'))
@@ -96,548 +140,813 @@ def create_run(text, italic=True):
     t.text = text if text else ''
     return r
 
-def convert_mi(elem):
+def convert_mi(elem, parent, stack):
     text = elem.text or ''
-    mathvariant = elem.get('mathvariant', '')
-    is_function = len(text) > 1 or mathvariant == 'normal'
-    return create_run(text, italic=not is_function)
+    is_function = len(text) > 1 or elem.get('mathvariant', '') == 'normal'
+    create_run(parent, text, italic=not is_function)
+
+def convert_mn(elem, parent, stack):
+    create_run(parent, elem.text or '', italic=False)
 
-def convert_mn(elem):
-    return create_run(elem.text or '', italic=False)
+MO_CHAR_MAP = {
+    '∑': '∑', '∏': '∏', '∫': '∫', '→': '→', '←': '←', '⇒': '⇒',
+    '≤': '≤', '≥': '≥', '≠': '≠', '∈': '∈', '∉': '∉',
+    '⋅': '·', '×': '×', '÷': '÷', '∀': '∀', '∃': '∃', '∞': '∞', '∂': '∂',
+}
 
-def convert_mo(elem):
+def convert_mo(elem, parent, stack):
     text = elem.text or ''
-    char_map = {
-        '∑': '∑', '∏': '∏', '∫': '∫', '→': '→', '←': '←', '⇒': '⇒',
-        '≤': '≤', '≥': '≥', '≠': '≠', '∈': '∈', '∉': '∉',
-        '⋅': '·', '×': '×', '÷': '÷', '∀': '∀', '∃': '∃', '∞': '∞', '∂': '∂',
-    }
-    return create_run(char_map.get(text, text), italic=False)
-
-def convert_mtext(elem):
-    return create_run(elem.text or '', italic=False)
-
-def append_content(parent, content):
-    if content is None:
-        return
-    if isinstance(content, list):
-        for item in content:
-            if item is not None:
-                parent.append(item)
-    else:
-        parent.append(content)
+    create_run(parent, MO_CHAR_MAP.get(text, text), italic=False)
 
-def convert_mfrac(elem):
-    children = list(elem)
-    if len(children) < 2:
-        return None
-    f = etree.Element(M('f'))
+def convert_mtext(elem, parent, stack):
+    create_run(parent, elem.text or '', italic=False)
+
+def convert_mspace(elem, parent, stack):
+    create_run(parent, ' ', italic=False)
+
+def convert_mfrac(elem, parent, stack):
+    if len(elem) < 2:
+        return
+    f = etree.SubElement(parent, M('f'))
     fPr = etree.SubElement(f, M('fPr'))
     typ = etree.SubElement(fPr, M('type'))
     typ.set(M('val'), 'bar')
     num = etree.SubElement(f, M('num'))
-    append_content(num, convert_element(children[0]))
     den = etree.SubElement(f, M('den'))
-    append_content(den, convert_element(children[1]))
-    return f
+    stack.append((elem[1], den))
+    stack.append((elem[0], num))
 
-def convert_msqrt(elem):
-    rad = etree.Element(M('rad'))
+def convert_msqrt(elem, parent, stack):
+    rad = etree.SubElement(parent, M('rad'))
     radPr = etree.SubElement(rad, M('radPr'))
     degHide = etree.SubElement(radPr, M('degHide'))
     degHide.set(M('val'), '1')
     etree.SubElement(rad, M('deg'))
     e = etree.SubElement(rad, M('e'))
-    for child in elem:
-        append_content(e, convert_element(child))
-    return rad
-
-def convert_mroot(elem):
-    children = list(elem)
-    if len(children) < 2:
-        return convert_msqrt(elem)
-    rad = etree.Element(M('rad'))
+    push_children(elem, e, stack)
+
+def convert_mroot(elem, parent, stack):
+    if len(elem) < 2:
+        convert_msqrt(elem, parent, stack)
+        return
+    rad = etree.SubElement(parent, M('rad'))
     etree.SubElement(rad, M('radPr'))
     deg = etree.SubElement(rad, M('deg'))
-    append_content(deg, convert_element(children[1]))
     e = etree.SubElement(rad, M('e'))
-    append_content(e, convert_element(children[0]))
-    return rad
+    stack.append((elem[1], deg))
+    stack.append((elem[0], e))
 
-def convert_msup(elem):
-    children = list(elem)
-    if len(children) < 2:
-        return None
-    sSup = etree.Element(M('sSup'))
-    etree.SubElement(sSup, M('sSupPr'))
-    e = etree.SubElement(sSup, M('e'))
-    append_content(e, convert_element(children[0]))
-    sup = etree.SubElement(sSup, M('sup'))
-    append_content(sup, convert_element(children[1]))
-    return sSup
-
-def convert_msub(elem):
-    children = list(elem)
-    if len(children) < 2:
-        return None
-    sSub = etree.Element(M('sSub'))
-    etree.SubElement(sSub, M('sSubPr'))
-    e = etree.SubElement(sSub, M('e'))
-    append_content(e, convert_element(children[0]))
-    sub = etree.SubElement(sSub, M('sub'))
-    append_content(sub, convert_element(children[1]))
-    return sSub
-
-def convert_msubsup(elem):
-    children = list(elem)
-    if len(children) < 3:
-        return None
-    sSubSup = etree.Element(M('sSubSup'))
-    etree.SubElement(sSubSup, M('sSubSupPr'))
-    e = etree.SubElement(sSubSup, M('e'))
-    append_content(e, convert_element(children[0]))
-    sub = etree.SubElement(sSubSup, M('sub'))
-    append_content(sub, convert_element(children[1]))
-    sup = etree.SubElement(sSubSup, M('sup'))
-    append_content(sup, convert_element(children[2]))
-    return sSubSup
+def _script(elem, parent, stack, name, slots):
+    """上下标结构: name 为 OMML 元素名, slots 为各子元素对应的容器名"""
+    if len(elem) < len(slots):
+        return
+    node = etree.SubElement(parent, M(name))
+    etree.SubElement(node, M(name + 'Pr'))
+    for i, slot in enumerate(slots):
+        stack.append((elem[i], etree.SubElement(node, M(slot))))
+
+def convert_msup(elem, parent, stack):
+    _script(elem, parent, stack, 'sSup', ('e', 'sup'))
+
+def convert_msub(elem, parent, stack):
+    _script(elem, parent, stack, 'sSub', ('e', 'sub'))
+
+def convert_msubsup(elem, parent, stack):
+    _script(elem, parent, stack, 'sSubSup', ('e', 'sub', 'sup'))
 
 def get_text_content(elem):
-    if elem.text:
-        return elem.text
-    for child in elem:
-        text = get_text_content(child)
-        if text:
-            return text
+    """按文档顺序返回第一个非空文本"""
+    for node in elem.iter():
+        if node.text:
+            return node.text
     return ''
 
-def create_nary(char, sub=None, sup=None, base=None):
-    nary = etree.Element(M('nary'))
+NARY_CHARS = frozenset(['∑', '∏', '∫', '⋃', '⋂'])
+ACCENT_MAP = {'^': '̂', '̂': '̂', '~': '̃', '̃': '̃', '¯': '̄', '̄': '̄', '→': '⃗', '⃗': '⃗'}
+
+def create_nary(parent, stack, char, sub=None, sup=None, base=None):
+    nary = etree.SubElement(parent, M('nary'))
     naryPr = etree.SubElement(nary, M('naryPr'))
     chr_el = etree.SubElement(naryPr, M('chr'))
     chr_el.set(M('val'), char)
     limLoc = etree.SubElement(naryPr, M('limLoc'))
     limLoc.set(M('val'), 'undOvr')
-    sub_el = etree.SubElement(nary, M('sub'))
-    if sub is not None:
-        append_content(sub_el, convert_element(sub))
-    sup_el = etree.SubElement(nary, M('sup'))
-    if sup is not None:
-        append_content(sup_el, convert_element(sup))
-    e = etree.SubElement(nary, M('e'))
-    if base is not None:
-        append_content(e, convert_element(base))
+    for child, slot in ((sub, 'sub'), (sup, 'sup'), (base, 'e')):
+        container = etree.SubElement(nary, M(slot))
+        if child is not None:
+            stack.append((child, container))
     return nary
 
-def convert_munder(elem):
-    children = list(elem)
-    if len(children) < 2:
-        return None
-    base_text = get_text_content(children[0])
-    if base_text in ['∑', '∏', '∫', '⋃', '⋂', 'lim']:
-        return create_nary(base_text, sub=children[1])
-    limLow = etree.Element(M('limLow'))
+def convert_munder(elem, parent, stack):
+    if len(elem) < 2:
+        return
+    base_text = get_text_content(elem[0])
+    if base_text in NARY_CHARS or base_text == 'lim':
+        create_nary(parent, stack, base_text, sub=elem[1])
+        return
+    limLow = etree.SubElement(parent, M('limLow'))
     etree.SubElement(limLow, M('limLowPr'))
     e = etree.SubElement(limLow, M('e'))
-    append_content(e, convert_element(children[0]))
     lim = etree.SubElement(limLow, M('lim'))
-    append_content(lim, convert_element(children[1]))
-    return limLow
+    stack.append((elem[1], lim))
+    stack.append((elem[0], e))
 
-def create_accent(base_elem, accent_char):
-    acc = etree.Element(M('acc'))
+def create_accent(parent, stack, base_elem, accent_char):
+    acc = etree.SubElement(parent, M('acc'))
     accPr = etree.SubElement(acc, M('accPr'))
     chr_el = etree.SubElement(accPr, M('chr'))
-    accent_map = {'^': '̂', '̂': '̂', '~': '̃', '̃': '̃', '¯': '̄', '̄': '̄', '→': '⃗', '⃗': '⃗'}
-    chr_el.set(M('val'), accent_map.get(accent_char, '̂'))
+    chr_el.set(M('val'), ACCENT_MAP.get(accent_char, '̂'))
     e = etree.SubElement(acc, M('e'))
-    append_content(e, convert_element(base_elem))
+    stack.append((base_elem, e))
     return acc
 
-def convert_mover(elem):
-    children = list(elem)
-    if len(children) < 2:
-        return None
-    accent_text = get_text_content(children[1])
-    if accent_text in ['^', '̂', '~', '̃', '¯', '̄', '→', '⃗']:
-        return create_accent(children[0], accent_text)
-    limUpp = etree.Element(M('limUpp'))
+def convert_mover(elem, parent, stack):
+    if len(elem) < 2:
+        return
+    accent_text = get_text_content(elem[1])
+    if accent_text in ACCENT_MAP:
+        create_accent(parent, stack, elem[0], accent_text)
+        return
+    limUpp = etree.SubElement(parent, M('limUpp'))
     etree.SubElement(limUpp, M('limUppPr'))
     e = etree.SubElement(limUpp, M('e'))
-    append_content(e, convert_element(children[0]))
     lim = etree.SubElement(limUpp, M('lim'))
-    append_content(lim, convert_element(children[1]))
-    return limUpp
+    stack.append((elem[1], lim))
+    stack.append((elem[0], e))
 
-def convert_munderover(elem):
-    children = list(elem)
-    if len(children) < 3:
-        return None
-    base_text = get_text_content(children[0])
-    if base_text in ['∑', '∏', '∫', '⋃', '⋂']:
-        return create_nary(base_text, sub=children[1], sup=children[2])
-    return convert_msubsup(elem)
+def convert_munderover(elem, parent, stack):
+    if len(elem) < 3:
+        return
+    base_text = get_text_content(elem[0])
+    if base_text in NARY_CHARS:
+        create_nary(parent, stack, base_text, sub=elem[1], sup=elem[2])
+        return
+    convert_msubsup(elem, parent, stack)
 
-def convert_mfenced(elem):
-    d = etree.Element(M('d'))
+def convert_mfenced(elem, parent, stack):
+    d = etree.SubElement(parent, M('d'))
     dPr = etree.SubElement(d, M('dPr'))
     begChr = etree.SubElement(dPr, M('begChr'))
     begChr.set(M('val'), elem.get('open', '('))
     endChr = etree.SubElement(dPr, M('endChr'))
     endChr.set(M('val'), elem.get('close', ')'))
     e = etree.SubElement(d, M('e'))
-    for child in elem:
-        append_content(e, convert_element(child))
-    return d
+    push_children(elem, e, stack)
 
-def convert_mtable(elem):
-    m_elem = etree.Element(M('m'))
+def convert_mtable(elem, parent, stack):
+    m_elem = etree.SubElement(parent, M('m'))
     etree.SubElement(m_elem, M('mPr'))
     for child in elem:
-        if etree.QName(child.tag).localname == 'mtr':
+        if _localname(child.tag) == 'mtr':
             mr = etree.SubElement(m_elem, M('mr'))
             for td in child:
-                if etree.QName(td.tag).localname == 'mtd':
+                if _localname(td.tag) == 'mtd':
                     e = etree.SubElement(mr, M('e'))
-                    for td_child in td:
-                        append_content(e, convert_element(td_child))
-    return m_elem
-
-def convert_mspace(elem):
-    return create_run(' ', italic=False)
-
-def convert_mstyle(elem):
-    results = []
-    for child in elem:
-        content = convert_element(child)
-        if content is not None:
-            if isinstance(content, list):
-                results.extend(content)
-            else:
-                results.append(content)
-    return results
+                    push_children(td, e, stack)
+
+# 分派表只构建一次; 未列出的元素 (math、semantics 等) 按容器展开
+_CONVERTERS = {
+    'mrow': push_children, 'mi': convert_mi, 'mn': convert_mn,
+    'mo': convert_mo, 'mtext': convert_mtext, 'mfrac': convert_mfrac,
+    'msqrt': convert_msqrt, 'mroot': convert_mroot, 'msup': convert_msup,
+    'msub': convert_msub, 'msubsup': convert_msubsup, 'munder': convert_munder,
+    'mover': convert_mover, 'munderover': convert_munderover,
+    'mfenced': convert_mfenced, 'mtable': convert_mtable,
+    'mspace': convert_mspace, 'mstyle': push_children,
+    'mpadded': push_children, 'menclose': push_children,
+}
+
+# ===== Formula Cache =====
+FORMULA_CACHE_SIZE = 2048
+
+class FormulaCache:
+    """公式转换结果的LRU缓存: 键为规范化后的LaTeX, 值为OMML元素 (转换失败记为None)"""
+
+    def __init__(self, maxsize=FORMULA_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        """是否已缓存 (不计入命中统计, 也不更新LRU顺序)"""
+        with self._lock:
+            return key in self._data
+
+    def get(self, key):
+        """命中返回 (True, OMML副本), 未命中返回 (False, None)"""
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.hits += 1
+            omml = self._data[key]
+        return True, (copy.deepcopy(omml) if omml is not None else None)
+
+    def put(self, key, omml):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = omml
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._data) > max(maxsize, 0):
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+FORMULA_CACHE = FormulaCache()
+
+def set_formula_cache_size(maxsize):
+    """设置公式缓存容量, 0 表示关闭缓存"""
+    FORMULA_CACHE.resize(maxsize)
+
+# ===== Persistent Formula Cache =====
+DISK_CACHE_MAX_BYTES = 64 * 1024 * 1024
+DISK_CACHE_STALE_SECONDS = 30 * 24 * 3600  # 其他版本的条目超过这么久未被访问即淘汰
+
+def default_cache_path():
+    """默认的磁盘公式缓存位置 (命令行 --cache 不写路径时使用)"""
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or Path.home() / 'AppData' / 'Local'
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(base) / 'md2docx' / 'formulas.sqlite3'
+
+def _code_digest(code, h):
+    h.update(code.co_code)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _code_digest(const, h)
+        else:
+            h.update(repr(const).encode('utf-8'))
 
-def convert_mpadded(elem):
-    return convert_mstyle(elem)
+def converter_version():
+    """转换器版本标签: 本模块函数字节码、latex2mathml版本或LaTeX预处理配置变化时, 磁盘缓存自动失效"""
+    h = hashlib.sha1()
+    try:
+        from importlib.metadata import version
+        h.update(version('latex2mathml').encode('utf-8'))
+    except Exception:
+        pass
+    for name, obj in sorted(globals().items()):
+        if isinstance(obj, types.FunctionType) and obj.__module__ == __name__:
+            h.update(name.encode('utf-8'))
+            _code_digest(obj.__code__, h)
+    # 自定义运算符名与宏同样影响转换结果
+    operators, macros = latex_config()
+    h.update(repr((operators, sorted(macros.items()))).encode('utf-8'))
+    return h.hexdigest()
+
+class DiskFormulaCache:
+    """SQLite磁盘公式缓存, 可由多个进程同时使用; 超过容量时按最近访问时间淘汰
+
+    条目按 (版本, LaTeX) 存放, 使用不同版本 (如不同 LaTeX 配置) 的进程可共享同一文件;
+    其他版本的条目不在打开时删除, 长期未访问或超出容量时才淘汰。
+    """
+
+    def __init__(self, path, max_bytes=DISK_CACHE_MAX_BYTES):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.version = converter_version()
+        self._pending = {}
+        self._touched = set()
+        self._lock = threading.Lock()
+        # 目录无法创建或数据库无法打开时抛出 OSError / sqlite3.Error
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        try:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            with self._conn:
+                self._conn.execute(
+                    'CREATE TABLE IF NOT EXISTS formulas ('
+                    ' version TEXT NOT NULL, latex TEXT NOT NULL, omml BLOB,'
+                    ' size INTEGER NOT NULL, atime REAL NOT NULL,'
+                    ' PRIMARY KEY (version, latex))')
+                self._conn.execute('CREATE INDEX IF NOT EXISTS formulas_atime ON formulas (atime)')
+        except BaseException:
+            self._conn.close()
+            raise
+
+    def get(self, latex):
+        """命中返回 (True, 序列化OMML或None), 未命中返回 (False, None)"""
+        with self._lock:
+            if latex in self._pending:
+                return True, self._pending[latex]
+            row = self._conn.execute(
+                'SELECT omml FROM formulas WHERE version = ? AND latex = ?',
+                (self.version, latex)).fetchone()
+            if row is None:
+                return False, None
+            self._touched.add(latex)
+            return True, row[0]
+
+    def put(self, latex, data):
+        with self._lock:
+            self._pending[latex] = data
+
+    def set_version(self, version):
+        """切换版本标签 (如LaTeX预处理配置变化), 先按旧版本写入已有的新条目"""
+        self.flush()
+        with self._lock:
+            self.version = version
+
+    def flush(self):
+        """写入新条目、更新访问时间并执行容量淘汰"""
+        with self._lock:
+            if not self._pending and not self._touched:
+                return
+            now = time.time()
+            try:
+                with self._conn:
+                    self._conn.executemany(
+                        'INSERT OR REPLACE INTO formulas VALUES (?, ?, ?, ?, ?)',
+                        [(self.version, latex, data, len(latex) + len(data or b''), now)
+                         for latex, data in self._pending.items()])
+                    self._conn.executemany(
+                        'UPDATE formulas SET atime = ? WHERE version = ? AND latex = ?',
+                        [(now, self.version, latex) for latex in self._touched])
+                    self._evict()
+            except sqlite3.Error:
+                # 缓存只是加速手段, 数据库繁忙或只读时放弃本次写入
+                pass
+            self._pending.clear()
+            self._touched.clear()
+
+    def _evict(self):
+        self._conn.execute('DELETE FROM formulas WHERE atime < ? AND version != ?',
+                           (time.time() - DISK_CACHE_STALE_SECONDS, self.version))
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM formulas').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = total - self.max_bytes * 9 // 10
+        freed = 0
+        doomed = []
+        for version, latex, size in self._conn.execute(
+                'SELECT version, latex, size FROM formulas ORDER BY atime'):
+            doomed.append((version, latex))
+            freed += size
+            if freed >= target:
+                break
+        self._conn.executemany('DELETE FROM formulas WHERE version = ? AND latex = ?', doomed)
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+DISK_CACHE = None
+
+def set_disk_cache(path, max_bytes=DISK_CACHE_MAX_BYTES):
+    """启用磁盘公式缓存 (path 为 None 时关闭)"""
+    global DISK_CACHE
+    if DISK_CACHE is not None:
+        DISK_CACHE.close()
+        DISK_CACHE = None
+    if path is not None:
+        DISK_CACHE = DiskFormulaCache(path, max_bytes)
+    return DISK_CACHE
+
+def try_disk_cache(path):
+    """启用磁盘公式缓存; 缓存只是加速手段, 无法使用时不启用并返回错误说明, 成功时返回 None"""
+    try:
+        set_disk_cache(path)
+    except (OSError, sqlite3.Error) as e:
+        return f"无法使用公式缓存 {path}: {e}; 本次不使用缓存"
+    return None
 
-def convert_menclose(elem):
-    return convert_mstyle(elem)
+@atexit.register
+def _close_disk_cache():
+    if DISK_CACHE is not None:
+        DISK_CACHE.close()
 
 # ===== LaTeX Processing =====
+# 写作 \name 时改为 \operatorname{name} 的运算符名 (latex2mathml 不认识这些命令)
+DEFAULT_LATEX_OPERATORS = (
+    'softmax', 'clip', 'Attention', 'MultiHead', 'Concat', 'AGG',
+    'ActualSaving', 'ExpectedSaving', 'ComfortViolation', 'SafetyViolation',
+    'CLIP', 'VF', 'ReLU', 'sigmoid', 'tanh', 'argmax', 'argmin',
+)
+# 字体命令只替换前缀。与依次对每种命令执行 re.sub(r'\\cmd\{([^}]*)\}', ...) 的结果相同:
+# 命令的作用范围到其后第一个 } 为止, 范围内的同名命令保持原样; \mathbb / \mathcal
+# 还删去范围末尾的 } (\mathcal 在 \mathbb 之后处理, 不计 \mathbb 已删去的 })。
+_LATEX_FONTS = {'text': '\\mathrm{', 'mathbf': '\\mathrm{', 'mathbb': '', 'mathcal': ''}
+_LATEX_FONT_HINTS = ('\\text{', '\\mathbf{', '\\mathbb{', '\\mathcal{')
+_LATEX_NAME_RE = re.compile(r'[A-Za-z]+')
+
+LATEX_OPERATORS = DEFAULT_LATEX_OPERATORS
+LATEX_MACROS = {}
+# (是否展开宏, 是否跟踪右括号) → 正则: 字体命令 | 宏 | 运算符名 | 连续汉字 [| }]
+# 单次扫描完成全部替换; 不含宏的用于宏的展开结果, 只在出现字体命令时才逐个匹配 }
+_LATEX_RES = {}
+
+def _compile_latex_re(operators, macros, braces):
+    def names(group, items):
+        if not items:
+            return rf'\\(?P<{group}>(?!))'
+        alternatives = '|'.join(map(re.escape, sorted(items, key=len, reverse=True)))
+        return rf'\\(?P<{group}>{alternatives})(?![A-Za-z])'
+    return re.compile('|'.join([
+        r'\\(?P<font>text|mathbf|mathbb|mathcal)\{(?=[^}]*\})',
+        names('macro', macros),
+        names('op', operators),
+        r'(?P<cjk>[\u4e00-\u9fff]+)',
+        r'(?P<close>\})' if braces else r'(?P<close>(?!))',
+    ]))
+
+def _rewrite_latex(latex, expand_macros=True, mathcal_limit=None):
+    """单次扫描完成预处理; mathcal_limit 为最多改写的 \\mathcal 个数 (其后的保持原样)"""
+    braces = any(hint in latex for hint in _LATEX_FONT_HINTS)
+    regex = _LATEX_RES[expand_macros, braces]
+    open_fonts = set()  # 作用范围尚未结束的字体命令
+    mathcal_count = 0
+
+    def replace(m):
+        kind = m.lastgroup
+        if kind == 'close':
+            drop = 'mathbb' in open_fonts or 'mathcal' in open_fonts
+            if 'mathbb' not in open_fonts:
+                open_fonts.discard('mathcal')
+            open_fonts.difference_update(('text', 'mathbf', 'mathbb'))
+            return '' if drop else '}'
+        if kind == 'font':
+            nonlocal mathcal_count
+            font = m.group('font')
+            if font in open_fonts:
+                return m.group(0)
+            if font == 'mathcal':
+                if mathcal_count == mathcal_limit:
+                    return m.group(0)
+                mathcal_count += 1
+            open_fonts.add(font)
+            return _LATEX_FONTS[font]
+        if kind == 'op':
+            return f"\\operatorname{{{m.group('op')}}}"
+        if kind == 'macro':
+            return _rewrite_latex(LATEX_MACROS[m.group('macro')], False)
+        return f"\\text{{{m.group('cjk')}}}"
+
+    result = regex.sub(replace, latex)
+    if 'mathcal' in open_fonts:
+        # 其后的 } 都被 \\mathbb 删去 (括号不配对的输入): 最后这个 \\mathcal 不应改写
+        return _rewrite_latex(latex, expand_macros, mathcal_count - 1)
+    return result
+
+def configure_latex(operators=None, macros=None):
+    """设置 preprocess_latex 的运算符名与宏 (None 恢复默认)
+
+    operators 中的名称写作 \\name 时转为 \\operatorname{name}; macros 为 {名称: 展开文本}
+    形式的无参数宏, 展开结果中的宏不再展开。名称只能由字母组成。
+    设置变化时清空内存公式缓存, 磁盘缓存改用新的版本标签。
+    """
+    global LATEX_OPERATORS, LATEX_MACROS
+    operators = tuple(dict.fromkeys(DEFAULT_LATEX_OPERATORS if operators is None else operators))
+    macros = dict(macros or {})
+    for name in (*operators, *macros):
+        if not isinstance(name, str) or not _LATEX_NAME_RE.fullmatch(name):
+            raise ValueError(f"无效的命令名: {name!r}")
+    for name, expansion in macros.items():
+        if not isinstance(expansion, str):
+            raise ValueError(f"宏 {name} 的展开文本不是字符串")
+    changed = bool(_LATEX_RES) and (operators, macros) != (LATEX_OPERATORS, LATEX_MACROS)
+    LATEX_OPERATORS = operators
+    LATEX_MACROS = macros
+    _LATEX_RES.update({(expand, braces): _compile_latex_re(operators, macros if expand else (), braces)
+                       for expand in (True, False) for braces in (True, False)})
+    if changed:
+        FORMULA_CACHE.clear()
+        if DISK_CACHE is not None:
+            DISK_CACHE.set_version(converter_version())
+
+configure_latex()
+
+def load_latex_config(path):
+    """读取 JSON 配置文件并应用: {"operators": [...], "macros": {"名称": "展开文本"}}
+
+    operators 追加到默认运算符名之后。文件不存在时抛出 FileNotFoundError,
+    格式错误时抛出 ValueError。
+    """
+    import json
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError(f"LaTeX配置应为 JSON 对象: {path}")
+    operators = config.get('operators', [])
+    macros = config.get('macros', {})
+    if not isinstance(operators, list) or not isinstance(macros, dict):
+        raise ValueError(f"LaTeX配置中 operators 应为列表、macros 应为对象: {path}")
+    configure_latex(DEFAULT_LATEX_OPERATORS + tuple(operators), macros)
+
+def latex_config():
+    """当前的 (运算符名, 宏), 用于把设置传给子进程"""
+    return LATEX_OPERATORS, dict(LATEX_MACROS)
+
 def preprocess_latex(latex_str):
-    """预处理LaTeX"""
-    s = latex_str.strip()
-    s = re.sub(r'\\text\{([^}]*)\}', r'\\mathrm{\1}', s)
-    s = re.sub(r'\\mathbf\{([^}]*)\}', r'\\mathrm{\1}', s)
-    s = re.sub(r'\\mathbb\{([^}]*)\}', r'\1', s)
-    s = re.sub(r'\\mathcal\{([^}]*)\}', r'\1', s)
-
-    for func in ['softmax', 'clip', 'Attention', 'MultiHead', 'Concat', 'AGG',
-                 'ActualSaving', 'ExpectedSaving', 'ComfortViolation', 'SafetyViolation',
-                 'CLIP', 'VF', 'ReLU', 'sigmoid', 'tanh', 'argmax', 'argmin']:
-        s = s.replace(f'\\{func}', f'\\operatorname{{{func}}}')
-
-    s = re.sub(r'([\u4e00-\u9fff]+)', r'\\text{\1}', s)
-    return s
-
-def latex_to_omml(latex_str):
-    """LaTeX → OMML"""
+    """预处理LaTeX: 字体命令、自定义运算符名、宏与中文, 单次扫描完成"""
+    return _rewrite_latex(latex_str.strip())
+
+def normalize_latex(latex_str):
+    """去除首尾空白与$定界符, 作为公式缓存的键"""
     latex_str = latex_str.strip()
     while latex_str.startswith('$'):
         latex_str = latex_str[1:]
     while latex_str.endswith('$'):
         latex_str = latex_str[:-1]
-    latex_str = latex_str.strip()
-
-    if not latex_str:
-        return None
-
+    return latex_str.strip()
+
+_XML_REF_RE = re.compile(r'&(?:#[xX]([0-9a-fA-F]+)|#([0-9]+)|(amp|lt|gt|quot|apos));')
+_XML_ENTITIES = {'amp': '&', 'lt': '<', 'gt': '>', 'quot': '"', 'apos': "'"}
+
+def _resolve_xml_ref(match):
+    hex_code, dec_code, name = match.groups()
+    if name:
+        return _XML_ENTITIES[name]
+    return chr(int(hex_code, 16) if hex_code else int(dec_code))
+
+def latex_to_mathml_tree(latex_str):
+    """LaTeX → MathML元素树, 直接取 latex2mathml 的解析结果而不经过字符串序列化
+
+    latex2mathml 在元素文本中以字符引用 (如 &#x0003D;) 保存特殊字符,
+    这里将其还原, 得到与"序列化后再解析"完全相同的元素树。
+    """
+    to_element = getattr(latex2mathml_converter, 'convert_to_element', None)
+    if to_element is None:
+        # 旧版 latex2mathml 只提供字符串接口
+        return etree.fromstring(latex2mathml_converter.convert(latex_str).encode('utf-8'))
+    tree = to_element(latex_str)
+    for elem in tree.iter():
+        text = elem.text
+        if text and '&' in text:
+            elem.text = _XML_REF_RE.sub(_resolve_xml_ref, text)
+        for key, value in elem.attrib.items():
+            if '&' in value:
+                elem.set(key, _XML_REF_RE.sub(_resolve_xml_ref, value))
+    return tree
+
+def _convert_latex(latex_str):
+    """规范化后的LaTeX → OMML (不经过缓存)"""
     latex_str = preprocess_latex(latex_str)
-
     try:
-        mathml_str = latex2mathml.converter.convert(latex_str)
-        mathml_tree = etree.fromstring(mathml_str.encode('utf-8'))
-        return mathml_to_omml(mathml_tree)
+        return mathml_to_omml(latex_to_mathml_tree(latex_str))
     except Exception:
         return None
 
-def add_omml_to_paragraph(paragraph, latex_str):
-    """将OMML添加到段落"""
-    omml = latex_to_omml(latex_str)
-    if omml is not None:
-        omath_list = omml.findall(f'.//{M("oMath")}')
-        if omath_list:
-            for omath in omath_list:
-                paragraph._element.append(omath)
-            return True
-    run = paragraph.add_run(latex_str)
-    run.font.name = 'Cambria Math'
-    run.font.size = Pt(12)
-    run.italic = True
-    return False
+# 本线程当前转换预先并行转换好的公式: {LaTeX: 序列化OMML或None}, 见 prefetch_formulas
+_PREFETCHED = threading.local()
+
+def _lookup_or_convert(latex_str, stats):
+    """依次查询内存缓存、预转换结果、磁盘缓存, 都未命中时才真正转换"""
+    found, omml = FORMULA_CACHE.get(latex_str)
+    if found:
+        if stats is not None:
+            stats['cache_hits'] += 1
+        return omml
+
+    prefetched = getattr(_PREFETCHED, 'omml', None)
+    if prefetched and latex_str in prefetched:
+        # 已在进程池中转换, 统计上与在此处转换相同
+        if stats is not None:
+            stats['cache_misses'] += 1
+        data = prefetched[latex_str]
+        omml = etree.fromstring(data) if data is not None else None
+        FORMULA_CACHE.put(latex_str, omml)
+        if DISK_CACHE is not None:
+            DISK_CACHE.put(latex_str, data)
+        return copy.deepcopy(omml) if omml is not None else None
+
+    if DISK_CACHE is not None:
+        found, data = DISK_CACHE.get(latex_str)
+        if found:
+            if stats is not None:
+                stats['disk_hits'] += 1
+            omml = etree.fromstring(data) if data is not None else None
+            FORMULA_CACHE.put(latex_str, omml)
+            return copy.deepcopy(omml) if omml is not None else None
+
+    if stats is not None:
+        stats['cache_misses'] += 1
+    omml = _convert_latex(latex_str)
+    FORMULA_CACHE.put(latex_str, omml)
+    if DISK_CACHE is not None:
+        DISK_CACHE.put(latex_str, etree.tostring(omml) if omml is not None else None)
+    return copy.deepcopy(omml) if omml is not None else None
+
+def latex_to_omml(latex_str, stats=None):
+    """LaTeX → OMML (经内存/磁盘缓存, 每次返回新副本)"""
+    latex_str = normalize_latex(latex_str)
+    if not latex_str:
+        return None
+    return _lookup_or_convert(latex_str, stats)
+
+def add_omml_to_paragraph(paragraph, latex_str, stats=None):
+    """将OMML添加到 python-docx 段落"""
+    return append_inline_formula(paragraph._p, latex_str, stats)
 
 # ===== Math Detection in Text =====
+# 裸数学表达式的默认识别模式 (方括号/圆括号内不跨越 $ 公式)
+DEFAULT_MATH_PATTERNS = (
+    r'[A-Z][a-zA-Z]*_\{?[a-zA-Z0-9,]+\}?',
+    r'[a-zA-Z]_\{?[a-zA-Z0-9,]+\}?\^\{?\([^)$]+\)\}?',
+    r'[a-zA-Z]\^\{?\([^)$]+\)\}?_\{?[a-zA-Z0-9,]+\}?',
+    r'[A-Za-zπ][_^]?\{?[\\a-zA-Z0-9]+\}?\([^)$]+\)',
+    r'[a-zA-Z]_\{?[a-zA-Z0-9]+\}?(?!\()',
+    r'p_transferable', r'P_\{?conflict\}?',
+    r'[A-Z]\^[A-Z]',
+    r'[αβγδεζηθλμνξπρσφχψωΓΔΘΛΞΠΣΦΨΩ][_^]?\{?[a-zA-Z0-9₀-₉]+\}?',
+    r'∈\[[^\]$]+\]',
+    r'(?<![a-zA-Z\u4e00-\u9fff])[αβγδεζηθλμνξπρσφχψωΓΔΘΛΞΠΣΦΨΩε](?![a-zA-Z\u4e00-\u9fff])',
+)
+
+# 预过滤正则: 默认模式的每一条都至少要求出现 _ ^ ∈ 希腊字母之一,
+# 或紧跟在标识符之后的左括号 (函数调用形式 f(x));
+# 不匹配的文本 (大部分普通段落) 无需进入完整的识别正则
+DEFAULT_MATH_TRIGGERS = r'[_^∈αβγδεζηθλμνξπρσφχψωΓΔΘΛΞΠΣΦΨΩ]|(?<=[\\A-Za-z0-9π}])\('
+
+def _compile_inline_re(math_patterns):
+    """行内记号正则: $公式$ | ** 加粗标记 (opens 表示其后存在配对的 **) | 裸数学表达式"""
+    parts = [r'\$(?P<formula>[^$]+)\$', r'(?P<bold>\*\*)(?P<opens>(?=[^*]+\*\*))?']
+    if math_patterns:
+        parts.append('(?P<math>' + '|'.join(f'(?:{p})' for p in math_patterns) + ')')
+    return re.compile('|'.join(parts))
+
+_INLINE_PLAIN_RE = _compile_inline_re(None)
+
+def configure_math_detection(patterns=None, triggers=None):
+    """设置裸数学表达式的识别模式
+
+    patterns 为 None 时恢复默认模式, 为空序列时关闭识别;
+    triggers 为预过滤正则, 文本中搜索不到时直接视为无数学表达式。
+    自定义 patterns 而未给出 triggers 时不做预过滤。
+    """
+    global MATH_PATTERNS, MATH_TRIGGERS, _MATH_TRIGGER_RE, _MATH_RE, _INLINE_RE
+    if patterns is None:
+        patterns = DEFAULT_MATH_PATTERNS
+        if triggers is None:
+            triggers = DEFAULT_MATH_TRIGGERS
+    patterns = tuple(patterns)
+    MATH_PATTERNS = patterns
+    MATH_TRIGGERS = triggers
+    _MATH_TRIGGER_RE = re.compile(triggers) if triggers is not None else None
+    _MATH_RE = re.compile('|'.join(f'(?:{p})' for p in patterns)) if patterns else None
+    _INLINE_RE = _compile_inline_re(patterns)
+
+configure_math_detection()
+
+def math_possible(text):
+    """预过滤: 文本可能含有裸数学表达式时返回True"""
+    if _MATH_RE is None:
+        return False
+    return _MATH_TRIGGER_RE is None or _MATH_TRIGGER_RE.search(text) is not None
+
 def identify_math_in_text(text):
-    """识别文本中的数学表达式"""
-    patterns = [
-        r'[A-Z][a-zA-Z]*_\{?[a-zA-Z0-9,]+\}?',
-        r'[a-zA-Z]_\{?[a-zA-Z0-9,]+\}?\^\{?\([^)]+\)\}?',
-        r'[a-zA-Z]\^\{?\([^)]+\)\}?_\{?[a-zA-Z0-9,]+\}?',
-        r'[A-Za-zπ][_^]?\{?[\\a-zA-Z0-9]+\}?\([^)]+\)',
-        r'[a-zA-Z]_\{?[a-zA-Z0-9]+\}?(?!\()',
-        r'p_transferable', r'P_\{?conflict\}?',
-        r'[A-Z]\^[A-Z]',
-        r'[αβγδεζηθλμνξπρσφχψωΓΔΘΛΞΠΣΦΨΩ][_^]?\{?[a-zA-Z0-9₀-₉]+\}?',
-        r'∈\[[^\]]+\]',
-        r'(?<![a-zA-Z\u4e00-\u9fff])[αβγδεζηθλμνξπρσφχψωΓΔΘΛΞΠΣΦΨΩε](?![a-zA-Z\u4e00-\u9fff])',
-    ]
-
-    combined = '|'.join(f'({p})' for p in patterns)
-    segments = [(m.start(), m.end(), m.group()) for m in re.finditer(combined, text)]
-
-    if not segments:
+    """识别文本中的数学表达式, 返回 (起点, 终点, 表达式) 列表"""
+    if not math_possible(text):
         return []
-
-    segments.sort(key=lambda x: x[0])
-    merged = [segments[0]]
-    for seg in segments[1:]:
-        if seg[0] < merged[-1][1]:
-            if seg[1] - seg[0] > merged[-1][1] - merged[-1][0]:
-                merged[-1] = seg
-        else:
-            merged.append(seg)
-    return merged
+    return [(m.start(), m.end(), m.group()) for m in _MATH_RE.finditer(text)]
+
+_TEXT_TO_LATEX = str.maketrans({
+    'α': r'\alpha', 'β': r'\beta', 'γ': r'\gamma', 'δ': r'\delta',
+    'ε': r'\epsilon', 'ζ': r'\zeta', 'η': r'\eta', 'θ': r'\theta',
+    'λ': r'\lambda', 'μ': r'\mu', 'ν': r'\nu', 'ξ': r'\xi',
+    'π': r'\pi', 'ρ': r'\rho', 'σ': r'\sigma', 'φ': r'\phi',
+    'χ': r'\chi', 'ψ': r'\psi', 'ω': r'\omega',
+    'Γ': r'\Gamma', 'Δ': r'\Delta', 'Θ': r'\Theta', 'Λ': r'\Lambda',
+    'Ξ': r'\Xi', 'Π': r'\Pi', 'Σ': r'\Sigma', 'Φ': r'\Phi',
+    'Ψ': r'\Psi', 'Ω': r'\Omega',
+    '₀': '_0', '₁': '_1', '₂': '_2', '₃': '_3', '₄': '_4',
+    '₅': '_5', '₆': '_6', '₇': '_7', '₈': '_8', '₉': '_9',
+    'ₐ': '_a', 'ₑ': '_e', 'ᵢ': '_i', 'ⱼ': '_j', 'ₖ': '_k',
+    'ₗ': '_l', 'ₘ': '_m', 'ₙ': '_n', 'ₒ': '_o', 'ₚ': '_p',
+    'ᵣ': '_r', 'ₛ': '_s', 'ₜ': '_t', 'ᵤ': '_u', 'ᵥ': '_v', 'ₓ': '_x',
+    '∈': r'\in ',
+})
 
 def text_to_latex(text):
-    """将识别出的数学文本转为LaTeX"""
-    s = text
-    greek_map = {
-        'α': r'\alpha', 'β': r'\beta', 'γ': r'\gamma', 'δ': r'\delta',
-        'ε': r'\epsilon', 'ζ': r'\zeta', 'η': r'\eta', 'θ': r'\theta',
-        'λ': r'\lambda', 'μ': r'\mu', 'ν': r'\nu', 'ξ': r'\xi',
-        'π': r'\pi', 'ρ': r'\rho', 'σ': r'\sigma', 'φ': r'\phi',
-        'χ': r'\chi', 'ψ': r'\psi', 'ω': r'\omega',
-        'Γ': r'\Gamma', 'Δ': r'\Delta', 'Θ': r'\Theta', 'Λ': r'\Lambda',
-        'Ξ': r'\Xi', 'Π': r'\Pi', 'Σ': r'\Sigma', 'Φ': r'\Phi',
-        'Ψ': r'\Psi', 'Ω': r'\Omega',
-    }
-    for gr, ltx in greek_map.items():
-        s = s.replace(gr, ltx)
-
-    subscript_map = {
-        '₀': '0', '₁': '1', '₂': '2', '₃': '3', '₄': '4',
-        '₅': '5', '₆': '6', '₇': '7', '₈': '8', '₉': '9',
-        'ₐ': 'a', 'ₑ': 'e', 'ᵢ': 'i', 'ⱼ': 'j', 'ₖ': 'k',
-        'ₗ': 'l', 'ₘ': 'm', 'ₙ': 'n', 'ₒ': 'o', 'ₚ': 'p',
-        'ᵣ': 'r', 'ₛ': 's', 'ₜ': 't', 'ᵤ': 'u', 'ᵥ': 'v', 'ₓ': 'x'
-    }
-    for uni, asc in subscript_map.items():
-        if uni in s:
-            s = s.replace(uni, f'_{asc}')
-
-    s = s.replace('∈', r'\in ')
-    return s
-
-# ===== Document Building =====
-def set_font(run, name='宋体', size=12, bold=False):
-    run.font.name = name
-    run.font.size = Pt(size)
-    run.bold = bold
-    rPr = run._element.get_or_add_rPr()
-    rFonts = rPr.get_or_add_rFonts()
-    rFonts.set(qn('w:eastAsia'), name)
-
-def add_heading(doc, text, level=1):
-    if level == 0:
-        p = doc.add_paragraph()
-        p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        run = p.add_run(text)
-        set_font(run, '黑体', 22, True)
-        p.paragraph_format.space_before = Pt(24)
-        p.paragraph_format.space_after = Pt(24)
-    else:
-        heading = doc.add_heading(text, level=level)
-        for run in heading.runs:
-            run.font.name = '黑体'
-            run._element.rPr.rFonts.set(qn('w:eastAsia'), '黑体')
-            run.font.size = Pt({1: 16, 2: 14, 3: 12}.get(level, 12))
-
-def add_formula_paragraph(doc, latex_str):
-    """添加独立公式段落"""
-    p = doc.add_paragraph()
-    p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    p.paragraph_format.space_before = Pt(6)
-    p.paragraph_format.space_after = Pt(6)
-    omml = latex_to_omml(latex_str)
-    if omml is not None:
-        p._element.append(omml)
-    else:
-        run = p.add_run(latex_str)
-        run.font.name = 'Cambria Math'
-        run.italic = True
-    return p
-
-def process_text_with_math(doc, text, indent=True, bold=False, stats=None):
-    """处理包含数学表达式的文本段落"""
-    p = doc.add_paragraph()
-    if indent:
-        p.paragraph_format.first_line_indent = Cm(0.85)
-
-    dollar_formulas = []
-    def replace_dollar(match):
-        idx = len(dollar_formulas)
-        dollar_formulas.append(match.group(1))
-        return f'\x00FORMULA{idx}\x00'
-
-    text_with_placeholders = re.sub(r'\$([^$]+)\$', replace_dollar, text)
-    math_segments = identify_math_in_text(text_with_placeholders)
+    """将识别出的数学文本转为LaTeX (希腊字母、下标数字与字母、∈)"""
+    return text.translate(_TEXT_TO_LATEX)
+
+# ===== Inline Tokenizer =====
+TOKEN_TEXT = 'text'        # 普通文本
+TOKEN_BOLD = 'bold'        # **加粗** 文本
+TOKEN_FORMULA = 'formula'  # $...$ 行内公式 (不含定界符)
+TOKEN_MATH = 'math'        # 自动识别的裸数学表达式
+
+_BOLD_RE = re.compile(r'\*\*([^*]+)\*\*')
+
+def tokenize_inline(text, detect_math=True):
+    """单次扫描一行文本, 依次产生 (类型, 内容) 记号
+
+    类型为 TOKEN_TEXT / TOKEN_BOLD / TOKEN_FORMULA / TOKEN_MATH;
+    不成对的 ** 保留为普通文本, 相邻文本合并为一个记号。
+    """
+    detect_math = detect_math and math_possible(text)
+    if not detect_math and '$' not in text and '*' not in text:
+        # 快速路径: 不含公式、加粗标记与数学表达式的普通文本
+        if text:
+            yield TOKEN_TEXT, text
+        return
 
-    segments = []
+    regex = _INLINE_RE if detect_math else _INLINE_PLAIN_RE
+    bold = False
+    pending = []
     pos = 0
-    for start, end, expr in math_segments:
-        if start > pos:
-            segments.append((pos, start, 'text', text_with_placeholders[pos:start]))
-        segments.append((start, end, 'inline', expr))
-        pos = end
-    if pos < len(text_with_placeholders):
-        segments.append((pos, len(text_with_placeholders), 'text', text_with_placeholders[pos:]))
-
-    if not segments:
-        segments = [(0, len(text_with_placeholders), 'text', text_with_placeholders)]
-
-    placeholder_pattern = r'\x00FORMULA(\d+)\x00'
-
-    for _, _, seg_type, content in segments:
-        if seg_type == 'text':
-            parts = re.split(placeholder_pattern, content)
-            i = 0
-            while i < len(parts):
-                if i % 2 == 0:
-                    if parts[i]:
-                        run = p.add_run(parts[i])
-                        set_font(run, '宋体', 12, bold)
-                else:
-                    idx = int(parts[i])
-                    latex = dollar_formulas[idx]
-                    if stats:
-                        stats['inline'] += 1
-                    add_omml_to_paragraph(p, latex)
-                i += 1
-        else:
-            latex = text_to_latex(content)
-            if stats:
-                stats['inline'] += 1
-            add_omml_to_paragraph(p, latex)
-    return p
-
-def add_bullet(doc, text, stats=None):
-    """添加项目符号"""
-    p = doc.add_paragraph(style='List Bullet')
-
-    dollar_formulas = []
-    def replace_dollar(match):
-        idx = len(dollar_formulas)
-        dollar_formulas.append(match.group(1))
-        return f'\x00FORMULA{idx}\x00'
-
-    text_clean = re.sub(r'\$([^$]+)\$', replace_dollar, text)
-    math_segments = identify_math_in_text(text_clean)
+    for m in regex.finditer(text):
+        if m.start() > pos:
+            pending.append(text[pos:m.start()])
+        pos = m.end()
+
+        if m.group('bold') is not None:
+            if bold or m.group('opens') is not None:
+                if pending:
+                    yield (TOKEN_BOLD if bold else TOKEN_TEXT), ''.join(pending)
+                    pending = []
+                bold = not bold
+            else:
+                pending.append('**')
+            continue
 
-    segments = []
-    pos = 0
-    for start, end, expr in math_segments:
-        if start > pos:
-            segments.append(('text', text_clean[pos:start]))
-        segments.append(('math', expr))
-        pos = end
-    if pos < len(text_clean):
-        segments.append(('text', text_clean[pos:]))
-
-    if not segments:
-        segments = [('text', text_clean)]
-
-    placeholder_pattern = r'\x00FORMULA(\d+)\x00'
-
-    for seg_type, content in segments:
-        if seg_type == 'text':
-            parts = re.split(placeholder_pattern, content)
-            i = 0
-            while i < len(parts):
-                if i % 2 == 0:
-                    if parts[i]:
-                        run = p.add_run(parts[i])
-                        set_font(run, '宋体', 12)
-                else:
-                    idx = int(parts[i])
-                    latex = dollar_formulas[idx]
-                    if stats:
-                        stats['inline'] += 1
-                    add_omml_to_paragraph(p, latex)
-                i += 1
+        if pending:
+            yield (TOKEN_BOLD if bold else TOKEN_TEXT), ''.join(pending)
+            pending = []
+        formula = m.group('formula')
+        if formula is not None:
+            if '**' in formula:
+                formula = _BOLD_RE.sub(r'\1', formula)
+            yield TOKEN_FORMULA, formula
         else:
-            latex = text_to_latex(content)
-            if stats:
-                stats['inline'] += 1
-            add_omml_to_paragraph(p, latex)
-    return p
-
-# ===== Main Conversion =====
-def convert_md_to_docx(input_file, output_file=None):
-    """主转换函数"""
-    input_path = Path(input_file)
-    if not input_path.exists():
-        raise FileNotFoundError(f"文件不存在: {input_file}")
-
-    if output_file is None:
-        output_file = input_path.with_suffix('.docx')
-
-    with open(input_file, 'r', encoding='utf-8') as f:
-        md_content = f.read()
-
-    doc = Document()
-
-    # 设置样式
-    style = doc.styles['Normal']
-    style.font.name = '宋体'
-    style.font.size = Pt(12)
-    style._element.rPr.rFonts.set(qn('w:eastAsia'), '宋体')
-
-    for section in doc.sections:
-        section.top_margin = Cm(2.54)
-        section.bottom_margin = Cm(2.54)
-        section.left_margin = Cm(3.17)
-        section.right_margin = Cm(3.17)
-
-    lines = md_content.split('\n')
-    i = 0
+            yield TOKEN_MATH, m.group('math')
+
+    if pos < len(text):
+        pending.append(text[pos:])
+    if pending:
+        yield (TOKEN_BOLD if bold else TOKEN_TEXT), ''.join(pending)
+
+# ===== Block Parser =====
+BLOCK_HEADING = 'heading'      # data: (级别, 文本), 级别 0 为文档标题
+BLOCK_FORMULA = 'formula'      # data: $$...$$ 中的LaTeX
+BLOCK_TABLE = 'table'          # data: 行列表, 每行为单元格文本列表 (已去掉分隔行)
+BLOCK_TABLE_ROWS = 'table_rows'  # data: 同上, 为上一个表格的后续行 (超长表格分段时)
+BLOCK_BULLET = 'bullet'        # data: 项目符号文本
+BLOCK_PARAGRAPH = 'paragraph'  # data: 段落文本
+
+# lineno 为块起始行号 (从1开始)
+Block = namedtuple('Block', 'kind data lineno')
+
+_TABLE_SEPARATOR_RE = re.compile(r'^\|[\s\-:|]+\|$')
+
+def iter_blocks(lines, table_chunk=None):
+    """逐行读取Markdown, 依次产生 Block 事件
+
+    lines 可以是打开的文件、字符串列表或任何逐行产生文本的迭代器,
+    源文本不会整体读入内存; 表格在读到下一个非表格行 (或输入结束) 时产生。
+    给出 table_chunk 时超长表格每积累这么多行就产生一次: 首段为 BLOCK_TABLE,
+    其后各段为 BLOCK_TABLE_ROWS。
+    """
     in_formula = False
     formula_buffer = ''
-    in_table = False
+    formula_lineno = 0
     table_rows = []
-    stats = {'block': 0, 'inline': 0}
+    table_lineno = 0
+    table_continued = False
 
-    while i < len(lines):
-        line = lines[i]
+    for lineno, line in enumerate(lines, 1):
         stripped = line.strip()
 
+        if (table_rows or table_continued) and not stripped.startswith('|'):
+            if table_rows:
+                yield Block(BLOCK_TABLE_ROWS if table_continued else BLOCK_TABLE,
+                            table_rows, table_lineno)
+            table_rows = []
+            table_continued = False
+
         if not stripped or stripped == '---':
-            i += 1
             continue
 
         # 标题
         if stripped.startswith('# ') and not stripped.startswith('## '):
-            add_heading(doc, stripped[2:], level=0)
-            i += 1
+            yield Block(BLOCK_HEADING, (0, stripped[2:]), lineno)
             continue
 
         if stripped.startswith('## '):
-            add_heading(doc, stripped[3:], level=1)
-            i += 1
+            yield Block(BLOCK_HEADING, (1, stripped[3:]), lineno)
             continue
 
         if stripped.startswith('### '):
-            add_heading(doc, stripped[4:], level=2)
-            i += 1
+            yield Block(BLOCK_HEADING, (2, stripped[4:]), lineno)
             continue
 
         # 独立公式块
@@ -646,14 +955,11 @@ def convert_md_to_docx(input_file, output_file=None):
             if rest.endswith('$$') and len(rest) > 2:
                 formula = rest[:-2].strip()
                 if formula:
-                    stats['block'] += 1
-                    add_formula_paragraph(doc, formula)
-            elif rest.endswith('$$'):
-                pass
-            else:
+                    yield Block(BLOCK_FORMULA, formula, lineno)
+            elif not rest.endswith('$$'):
                 in_formula = True
                 formula_buffer = rest
-            i += 1
+                formula_lineno = lineno
             continue
 
         if in_formula:
@@ -661,72 +967,1306 @@ def convert_md_to_docx(input_file, output_file=None):
                 formula_buffer += ' ' + stripped[:-2]
                 formula = formula_buffer.strip()
                 if formula:
-                    stats['block'] += 1
-                    add_formula_paragraph(doc, formula)
+                    yield Block(BLOCK_FORMULA, formula, formula_lineno)
                 formula_buffer = ''
                 in_formula = False
             else:
                 formula_buffer += ' ' + stripped
-            i += 1
             continue
 
         # 表格
         if stripped.startswith('|'):
-            if not in_table:
-                in_table = True
-                table_rows = []
-
-            if re.match(r'^\|[\s\-:|]+\|$', stripped):
-                i += 1
+            if _TABLE_SEPARATOR_RE.match(stripped):
                 continue
-
-            cells = [c.strip() for c in stripped.split('|')[1:-1]]
-            table_rows.append(cells)
-
-            next_is_table = i + 1 < len(lines) and lines[i + 1].strip().startswith('|')
-            if not next_is_table and table_rows:
-                ncols = max(len(row) for row in table_rows)
-                table = doc.add_table(rows=len(table_rows), cols=ncols)
-                table.style = 'Table Grid'
-
-                for row_idx, row_data in enumerate(table_rows):
-                    for col_idx, cell_text in enumerate(row_data):
-                        if col_idx < ncols:
-                            cell = table.rows[row_idx].cells[col_idx]
-                            cell.text = cell_text
-                            for para in cell.paragraphs:
-                                para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                                for run in para.runs:
-                                    set_font(run, '宋体', 10, row_idx == 0)
-
-                in_table = False
+            if not table_rows:
+                table_lineno = lineno
+            table_rows.append([c.strip() for c in stripped.split('|')[1:-1]])
+            if table_chunk and len(table_rows) >= table_chunk:
+                yield Block(BLOCK_TABLE_ROWS if table_continued else BLOCK_TABLE,
+                            table_rows, table_lineno)
                 table_rows = []
-
-            i += 1
+                table_continued = True
             continue
 
         # 项目符号
         if stripped.startswith('- '):
-            text = stripped[2:]
-            text = re.sub(r'\*\*([^*]+)\*\*', r'\1', text)
-            add_bullet(doc, text, stats)
-            i += 1
+            yield Block(BLOCK_BULLET, stripped[2:], lineno)
             continue
 
         # 普通段落
-        text = stripped
-        is_bold = text.startswith('**') and '**' in text[2:]
-        text = re.sub(r'\*\*([^*]+)\*\*', r'\1', text)
+        yield Block(BLOCK_PARAGRAPH, stripped, lineno)
+
+    if table_rows:
+        yield Block(BLOCK_TABLE_ROWS if table_continued else BLOCK_TABLE, table_rows, table_lineno)
+
+# ===== Parallel Formula Prefetch =====
+# 公式较多的文档中 LaTeX → OMML 转换占大部分时间。流水线模式先扫描一遍文档,
+# 收集并去重全部公式, 把尚未缓存的公式分块交给进程池转换为序列化的OMML,
+# 再构建文档: 构建时按 内存缓存 → 预转换结果 → 磁盘缓存 的顺序取用。
+PREFETCH_MIN_FORMULAS = 64  # 待转换公式少于此数时直接串行转换, 不值得启动进程池
+
+FORMULA_BLOCK = 'block'    # $$...$$ 公式块
+FORMULA_INLINE = 'inline'  # 段落或项目符号中的 $...$
+FORMULA_TABLE = 'table'    # 表格单元格中的 $...$
+FORMULA_BARE = 'bare'      # 自动识别的裸数学表达式 (已转为LaTeX)
+
+def iter_formulas(blocks, bare_math=True):
+    """依次产生 Block 事件流中渲染时会转换的公式: (LaTeX, 类型, 行号, 单元格)
+
+    LaTeX 为源文本中的写法 (未规范化); 单元格对表格为 (行, 列) 下标, 其余为 None,
+    此时行号为表格 (分段时为该段) 起始行。bare_math 为 False 时不包括自动识别的裸数学表达式。
+    """
+    for kind, data, lineno in blocks:
+        if kind == BLOCK_FORMULA:
+            yield data, FORMULA_BLOCK, lineno, None
+        elif kind == BLOCK_PARAGRAPH or kind == BLOCK_BULLET:
+            for token, value in tokenize_inline(data):
+                if token == TOKEN_FORMULA:
+                    yield value, FORMULA_INLINE, lineno, None
+                elif token == TOKEN_MATH and bare_math:
+                    yield text_to_latex(value), FORMULA_BARE, lineno, None
+        elif kind == BLOCK_TABLE or kind == BLOCK_TABLE_ROWS:
+            for r, row in enumerate(data):
+                for c, cell in enumerate(row):
+                    for token, value in tokenize_inline(cell, detect_math=False):
+                        if token == TOKEN_FORMULA:
+                            yield value, FORMULA_TABLE, lineno, (r, c)
+
+def collect_formulas(blocks):
+    """收集 Block 事件流中的全部公式 (规范化后的LaTeX), 按首次出现的顺序去重"""
+    seen = {}
+    for latex_str, _, _, _ in iter_formulas(blocks):
+        latex_str = normalize_latex(latex_str)
+        if latex_str:
+            seen[latex_str] = None
+    return list(seen)
+
+def _map_formula_chunks(func, latex_list, jobs):
+    """把公式列表分块交给进程池执行 func, 依次产生每块的结果"""
+    from concurrent.futures import ProcessPoolExecutor
+
+    # 分成每个进程约4块, 兼顾负载均衡与进程间通信开销
+    nchunks = min(len(latex_list), jobs * 4)
+    chunks = [latex_list[i::nchunks] for i in range(nchunks)]
+    with ProcessPoolExecutor(max_workers=min(jobs, nchunks), initializer=_init_prefetch_worker,
+                             initargs=(latex_config(),)) as pool:
+        yield from pool.map(func, chunks)
+
+def _init_prefetch_worker(latex_settings=None):
+    """子进程沿用主进程的LaTeX预处理配置; 不沿用剖析时开启的 tracemalloc, 以免转换慢一个数量级"""
+    import tracemalloc
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    if latex_settings is not None:
+        configure_latex(*latex_settings)
+
+def _convert_formula_chunk(latex_list):
+    """进程池任务: 转换一组公式, 返回 (LaTeX, 序列化OMML或None) 列表"""
+    results = []
+    for latex_str in latex_list:
+        omml = _convert_latex(latex_str)
+        results.append((latex_str, etree.tostring(omml) if omml is not None else None))
+    return results
+
+def prefetch_formulas(latex_list, jobs=None):
+    """用进程池并行转换尚未缓存的公式, 返回 {LaTeX: 序列化OMML或None}"""
+    todo = [latex_str for latex_str in latex_list
+            if latex_str not in FORMULA_CACHE
+            and not (DISK_CACHE is not None and DISK_CACHE.get(latex_str)[0])]
+    jobs = jobs or os.cpu_count() or 1
+    if jobs <= 1 or len(todo) < PREFETCH_MIN_FORMULAS:
+        return {}
+
+    results = {}
+    for part in _map_formula_chunks(_convert_formula_chunk, todo, jobs):
+        results.update(part)
+    return results
+
+# ===== Body Builder =====
+class BodyBuilder:
+    """文档正文构建器, 接口与 Document 的 add_paragraph / add_heading / add_table 相同
+
+    python-docx 每次追加块元素都要从头扫描 body 查找末尾的 sectPr,
+    块数上万时构建时间随块数平方增长; 这里记住 sectPr 作为插入点,
+    每次追加都是常数时间。样式名到样式ID的解析结果也一并缓存。
+    """
+
+    def __init__(self, doc):
+        self.doc = doc
+        self._body = doc.element.body
+        self._container = doc._body
+        self._anchor = self._body.find(qn('w:sectPr'))
+        self._style_ids = {}
+
+    def append(self, elem):
+        """追加一个已构建好的块元素 (w:p / w:tbl)"""
+        if self._anchor is not None:
+            self._anchor.addprevious(elem)
+        else:
+            self._body.append(elem)
+        return elem
+
+    def extend_table(self, rows):
+        """把行 (w:tr) 追加到最后追加的块 (表格) 末尾"""
+        tbl = self._anchor.getprevious() if self._anchor is not None else self._body[-1]
+        tbl.extend(rows)
+
+    def style_id(self, style, style_type):
+        key = (style, style_type)
+        if key not in self._style_ids:
+            self._style_ids[key] = self.doc.part.get_style_id(style, style_type)
+        return self._style_ids[key]
+
+    def add_paragraph(self, text='', style=None):
+        p = Paragraph(self.append(OxmlElement('w:p')), self._container)
+        if text:
+            p.add_run(text)
+        if style is not None:
+            p._p.style = self.style_id(style, WD_STYLE_TYPE.PARAGRAPH)
+        return p
+
+    def add_heading(self, text='', level=1):
+        if not 0 <= level <= 9:
+            raise ValueError(f"标题级别必须在 0-9 之间, 实际为 {level}")
+        return self.add_paragraph(text, 'Title' if level == 0 else f'Heading {level}')
+
+    def add_table(self, rows, cols, style=None):
+        tbl = CT_Tbl.new_tbl(rows, cols, self.doc._block_width)
+        table = Table(self.append(tbl), self._container)
+        if style is not None:
+            tbl.tblStyle_val = self.style_id(style, WD_STYLE_TYPE.TABLE)
+        return table
+
+# ===== Document Styles =====
+# 字体、字号、对齐与间距统一定义在 styles.xml 的命名样式中, 正文的run只写出
+# 与所在段落样式不同的格式 (加粗、公式回退时的字体与斜体)。
+PARAGRAPH_STYLES = {
+    # 名称: (字体, 字号, 加粗, 居中, 段前段后磅值, 首行缩进cm)
+    'MD Body': (None, None, None, False, None, 0.85),
+    'MD Title': ('黑体', 22, True, True, 24, None),
+    'MD Formula': (None, None, None, True, 6, None),
+    'MD Table': (None, 10, None, True, None, None),
+}
+HEADING_SIZES = {1: 16, 2: 14, 3: 12}
+
+def _set_style_font(style, name):
+    """设置样式字体 (含东亚字体), 去掉会覆盖显式字体的主题字体属性"""
+    style.font.name = name
+    rFonts = style.element.rPr.rFonts
+    for attr in ('asciiTheme', 'hAnsiTheme', 'eastAsiaTheme'):
+        rFonts.attrib.pop(qn(f'w:{attr}'), None)
+    rFonts.set(qn('w:eastAsia'), name)
+
+def setup_document_styles(doc):
+    """配置 Normal 与标题样式, 添加转换用的自定义段落样式"""
+    styles = doc.styles
+    normal = styles['Normal']
+    _set_style_font(normal, '宋体')
+    normal.font.size = Pt(12)
+
+    for level, size in HEADING_SIZES.items():
+        heading = styles[f'Heading {level}']
+        _set_style_font(heading, '黑体')
+        heading.font.size = Pt(size)
+
+    for name, (font, size, bold, center, spacing, indent) in PARAGRAPH_STYLES.items():
+        style = styles.add_style(name, WD_STYLE_TYPE.PARAGRAPH)
+        style.base_style = normal
+        style.next_paragraph_style = normal
+        style.quick_style = True
+        if font is not None:
+            _set_style_font(style, font)
+        if size is not None:
+            style.font.size = Pt(size)
+        if bold is not None:
+            style.font.bold = bold
+        fmt = style.paragraph_format
+        if center:
+            fmt.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        if spacing is not None:
+            fmt.space_before = Pt(spacing)
+            fmt.space_after = Pt(spacing)
+        if indent is not None:
+            fmt.first_line_indent = Cm(indent)
+
+# ===== Base Template =====
+# 配置好字体、样式与页边距的基础模板每个进程只构建一次。进程中的第一份文档直接
+# 使用构建出的模板; 需要更多文档时才缓存为 .docx 包的字节, 再从中克隆文档,
+# 不必重复解析默认模板包、修改样式与页边距。
+TEMPLATE_PATH = None  # 用户模板 (.dotx/.docx) 路径, None 时使用内置模板
+
+_TEMPLATE_LOCK = threading.Lock()
+_TEMPLATE_CACHE = {}                 # 模板路径 → 模板包字节
+_TEMPLATE_BUILT = set()              # 已直接构建过文档的模板路径
+_TEMPLATE_LOCAL = threading.local()  # 每线程的已解析模板: (路径, 文档, 原始 document 元素)
+
+_DOTX_MAIN = b'application/vnd.openxmlformats-officedocument.wordprocessingml.template.main+xml'
+_DOCX_MAIN = b'application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml'
+
+# 转换过程中引用的样式, 用户模板中缺少时从内置模板复制
+TEMPLATE_STYLES = ('Heading 1', 'Heading 2', 'Heading 3', 'List Bullet', 'Table Grid',
+                   *PARAGRAPH_STYLES)
+
+def set_template(path=None):
+    """设置基础模板: .dotx/.docx 文件路径, None 恢复内置模板"""
+    global TEMPLATE_PATH
+    if path is not None and not Path(path).is_file():
+        raise FileNotFoundError(f"模板文件不存在: {path}")
+    TEMPLATE_PATH = str(path) if path is not None else None
+
+def _build_default_template():
+    doc = Document()
+    setup_document_styles(doc)
+    for section in doc.sections:
+        section.top_margin = Cm(2.54)
+        section.bottom_margin = Cm(2.54)
+        section.left_margin = Cm(3.17)
+        section.right_margin = Cm(3.17)
+    return doc
+
+def _open_user_template(path):
+    """打开用户模板; .dotx 的主文档内容类型改为 .docx 的, python-docx 才能打开"""
+    import zipfile
+
+    data = Path(path).read_bytes()
+    with zipfile.ZipFile(io.BytesIO(data)) as zin:
+        content_types = zin.read('[Content_Types].xml')
+        if _DOTX_MAIN in content_types:
+            out = io.BytesIO()
+            with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as zout:
+                for item in zin.infolist():
+                    blob = zin.read(item)
+                    if item.filename == '[Content_Types].xml':
+                        blob = content_types.replace(_DOTX_MAIN, _DOCX_MAIN)
+                    zout.writestr(item, blob)
+            data = out.getvalue()
+    doc = Document(io.BytesIO(data))
+
+    # 模板中缺少的样式从内置模板复制, 已有的样式保持用户的定义
+    builtin = None
+    copied = {}
+    for name in TEMPLATE_STYLES:
+        try:
+            doc.styles[name]
+        except KeyError:
+            builtin = builtin or _build_default_template()
+            style = copy.deepcopy(builtin.styles[name].element)
+            _copy_style_numbering(style, builtin, doc, copied)
+            doc.styles.element.append(style)
+    return doc
+
+def _numbering_element(doc):
+    """doc 的编号部件根元素; 没有编号部件时新建一个空的 (python-docx 不会自动新建)"""
+    from docx.opc.constants import CONTENT_TYPE, RELATIONSHIP_TYPE
+    from docx.oxml import parse_xml
+    from docx.parts.numbering import NumberingPart
+
+    try:
+        return doc.part.part_related_by(RELATIONSHIP_TYPE.NUMBERING).element
+    except KeyError:
+        pass
+    package = doc.part.package
+    part = NumberingPart(package.next_partname('/word/numbering%d.xml'), CONTENT_TYPE.WML_NUMBERING,
+                         parse_xml(f'<w:numbering xmlns:w="{WORD_NS}"/>'), package)
+    doc.part.relate_to(part, RELATIONSHIP_TYPE.NUMBERING)
+    return part.element
+
+def _copy_style_numbering(style, builtin, doc, copied):
+    """样式引用内置模板的编号定义 (如 List Bullet 的项目符号) 时, 把定义复制到 doc 的
+    编号部件 (没有时新建) 并改用新的编号, 避免指向 doc 中同号的其他列表
+
+    copied 记录已复制的 内置编号 → 新编号, 多个样式引用同一定义时只复制一次。
+    """
+    num_id = style.find('w:pPr/w:numPr/w:numId', NSMAP)
+    if num_id is None:
+        return
+    old = num_id.get(W('val'))
+    if old not in copied:
+        source = builtin.part.numbering_part.element
+        num = source.find(f"w:num[@w:numId='{old}']", NSMAP)
+        abstract_id = num.find('w:abstractNumId', NSMAP).get(W('val'))
+        abstract = copy.deepcopy(source.find(f"w:abstractNum[@w:abstractNumId='{abstract_id}']", NSMAP))
+
+        numbering = _numbering_element(doc)
+        abstracts = numbering.findall('w:abstractNum', NSMAP)
+        nums = numbering.findall('w:num', NSMAP)
+        new_abstract = str(1 + max((int(a.get(W('abstractNumId'))) for a in abstracts), default=-1))
+        new_num = str(1 + max((int(n.get(W('numId'))) for n in nums), default=0))
+        abstract.set(W('abstractNumId'), new_abstract)
+        # 架构要求所有 abstractNum 位于 num 之前
+        if nums:
+            nums[0].addprevious(abstract)
+        elif abstracts:
+            abstracts[-1].addnext(abstract)
+        else:
+            numbering.insert(0, abstract)
+        elem = etree.Element(W('num'))
+        elem.set(W('numId'), new_num)
+        etree.SubElement(elem, W('abstractNumId')).set(W('val'), new_abstract)
+        (nums[-1] if nums else abstract).addnext(elem)
+        copied[old] = new_num
+    num_id.set(W('val'), copied[old])
+
+def _build_template(path):
+    return _build_default_template() if path is None else _open_user_template(path)
+
+def template_bytes(doc=None):
+    """当前基础模板的 .docx 包字节 (按模板路径缓存)
+
+    尚未缓存时, 给出 doc (刚从模板取出、尚未写入内容的文档) 则把它另存, 否则重新构建模板。
+    """
+    path = TEMPLATE_PATH
+    with _TEMPLATE_LOCK:
+        data = _TEMPLATE_CACHE.get(path)
+        if data is None:
+            buf = io.BytesIO()
+            (doc if doc is not None else _build_template(path)).save(buf)
+            data = _TEMPLATE_CACHE[path] = buf.getvalue()
+    return data
+
+def new_document():
+    """从基础模板新建文档 (字体、样式与页边距均已配置)"""
+    return Document(io.BytesIO(template_bytes()))
+
+def _checkout_document():
+    """转换用的文档: 复用本线程已解析的模板包, 只替换为一份新的 document 元素
+
+    其余部件 (样式、编号、主题等) 在转换中只读, 因此可在同一线程的多次转换间共享;
+    返回的文档在本线程下一次调用前有效。
+    """
+    path = TEMPLATE_PATH
+    cached = getattr(_TEMPLATE_LOCAL, 'template', None)
+    if cached is None or cached[0] != path:
+        with _TEMPLATE_LOCK:
+            first = path not in _TEMPLATE_CACHE and path not in _TEMPLATE_BUILT
+            _TEMPLATE_BUILT.add(path)
+        # 第一份文档直接使用构建出的模板, 省去一次序列化与解析
+        doc = _build_template(path) if first else new_document()
+        cached = _TEMPLATE_LOCAL.template = (path, doc, copy.deepcopy(doc.element))
+    part = cached[1].part
+    part._element = copy.deepcopy(cached[2])
+    return part.document
+
+# ===== Document Building =====
+# 段落与run直接构建为 WordprocessingML 元素, 不经过 python-docx 的代理对象,
+# 同一套构建函数可同时用于 python-docx 文档树与流式写出。
+_XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+_RUN_BREAK_RE = re.compile(r'([\t\r\n])')
+
+def _append_text(r, text):
+    """写入run文本: 与 python-docx 相同, 制表符为 w:tab, 换行为 w:br"""
+    if '\t' in text or '\r' in text or '\n' in text:
+        for piece in _RUN_BREAK_RE.split(text):
+            if piece == '\t':
+                etree.SubElement(r, W('tab'))
+            elif piece == '\r' or piece == '\n':
+                etree.SubElement(r, W('br'))
+            elif piece:
+                _append_text(r, piece)
+        return
+    t = etree.SubElement(r, W('t'))
+    t.text = text
+    if text != text.strip():
+        t.set(_XML_SPACE, 'preserve')
+
+def append_run(p, text, bold=False, font=None, italic=False):
+    """向段落元素追加run; 字体字号来自段落样式, 只写出加粗/斜体/字体等差异"""
+    r = etree.SubElement(p, W('r'))
+    if bold or italic or font is not None:
+        rPr = etree.SubElement(r, W('rPr'))
+        if font is not None:
+            fonts = etree.SubElement(rPr, W('rFonts'))
+            fonts.set(W('ascii'), font)
+            fonts.set(W('hAnsi'), font)
+        if bold:
+            etree.SubElement(rPr, W('b'))
+        if italic:
+            etree.SubElement(rPr, W('i'))
+    if text:
+        _append_text(r, text)
+    return r
+
+def new_paragraph(style_id=None):
+    """新建段落元素, style_id 为段落样式ID"""
+    p = etree.Element(W('p'), nsmap={'w': WORD_NS})
+    if style_id is not None:
+        etree.SubElement(etree.SubElement(p, W('pPr')), W('pStyle')).set(W('val'), style_id)
+    return p
+
+def paragraph_style(body, name):
+    return body.style_id(name, WD_STYLE_TYPE.PARAGRAPH)
+
+def append_inline_formula(p, latex_str, stats=None):
+    """把行内公式追加到段落元素; 无法转换时以 Cambria Math 斜体原样写出"""
+    omml = latex_to_omml(latex_str, stats)
+    if omml is not None:
+        omath_list = omml.findall(f'.//{M("oMath")}')
+        if omath_list:
+            p.extend(omath_list)
+            return True
+    append_run(p, latex_str, font='Cambria Math', italic=True)
+    return False
+
+def add_heading(body, text, level=1):
+    if level == 0:
+        p = new_paragraph(paragraph_style(body, 'MD Title'))
+        append_run(p, text)
+    else:
+        p = new_paragraph(paragraph_style(body, f'Heading {level}'))
+        if text:
+            append_run(p, text)
+    return body.append(p)
+
+def add_formula_paragraph(body, latex_str, stats=None):
+    """添加独立公式段落"""
+    p = new_paragraph(paragraph_style(body, 'MD Formula'))
+    omml = latex_to_omml(latex_str, stats)
+    if omml is not None:
+        p.append(omml)
+    else:
+        append_run(p, latex_str, font='Cambria Math', italic=True)
+    return body.append(p)
+
+def add_inline_content(p, text, bold=False, stats=None, detect_math=True):
+    """把一行文本的记号流写入段落元素: 文本为run, 公式与识别出的数学表达式为OMML"""
+    pending = []
+    pending_bold = bold
+
+    def flush():
+        if pending:
+            append_run(p, ''.join(pending), pending_bold)
+            pending.clear()
+
+    for kind, value in tokenize_inline(text, detect_math):
+        if kind == TOKEN_TEXT or kind == TOKEN_BOLD:
+            # 相邻且加粗状态相同的文本合并为一个run
+            run_bold = bold or kind == TOKEN_BOLD
+            if run_bold != pending_bold:
+                flush()
+                pending_bold = run_bold
+            pending.append(value)
+            continue
+        flush()
+        if kind == TOKEN_MATH:
+            value = text_to_latex(value)
+        if stats:
+            stats['inline'] += 1
+        append_inline_formula(p, value, stats)
+    flush()
+    return p
+
+def process_text_with_math(body, text, indent=True, bold=False, stats=None):
+    """处理包含数学表达式的文本段落"""
+    p = new_paragraph(paragraph_style(body, 'MD Body') if indent else None)
+    return body.append(add_inline_content(p, text, bold, stats))
+
+def add_bullet(body, text, stats=None):
+    """添加项目符号"""
+    p = new_paragraph(paragraph_style(body, 'List Bullet'))
+    return body.append(add_inline_content(p, text, stats=stats))
+
+# ===== Table Writer =====
+# 直接生成 w:tbl/w:tr/w:tc, 不经过 python-docx 的 table.rows[i].cells[j]
+# (每次访问都会重建整张表的单元格网格, 大表因此极慢)
+
+def _table_cell(tr, text, width, bold, style_id, stats=None):
+    """生成一个单元格 (MD Table 样式: 居中, 10磅); 文本中的 $...$ 转为公式, **...** 加粗"""
+    tc = etree.SubElement(tr, W('tc'))
+    tcW = etree.SubElement(etree.SubElement(tc, W('tcPr')), W('tcW'))
+    tcW.set(W('type'), 'dxa')
+    tcW.set(W('w'), width)
+    p = etree.SubElement(tc, W('p'))
+    if text is None:
+        return tc  # 短行缺少的单元格只放一个空段落
+    etree.SubElement(etree.SubElement(p, W('pPr')), W('pStyle')).set(W('val'), style_id)
+
+    for kind, value in tokenize_inline(text, detect_math=False):
+        if kind == TOKEN_TEXT or kind == TOKEN_BOLD:
+            append_run(p, value, bold or kind == TOKEN_BOLD)
+            continue
+        if stats:
+            stats['inline'] += 1
+        append_inline_formula(p, value, stats)
+    return tc
+
+def _table_row(tbl, row_data, layout, bold, stats=None):
+    ncols, width, style_id = layout
+    tr = etree.SubElement(tbl, W('tr'))
+    for col_idx in range(ncols):
+        text = row_data[col_idx] if col_idx < len(row_data) else None
+        _table_cell(tr, text, width, bold, style_id, stats)
+
+def add_markdown_table(body, rows, stats=None):
+    """一次生成整张表格: 首行为加粗表头, 单元格居中, 列宽均分"""
+    ncols = max(len(row) for row in rows)
+    if ncols == 0:
+        # 只有 "|" 的行没有单元格, 不生成表格; 分段时后续行另起一张表格
+        body.table_layout = None
+        return None
+    width = str(Emu(body.doc._block_width // ncols).twips)
+
+    tbl = etree.Element(W('tbl'), nsmap={'w': WORD_NS})
+    tblPr = etree.SubElement(tbl, W('tblPr'))
+    etree.SubElement(tblPr, W('tblStyle')).set(W('val'), body.style_id('Table Grid', WD_STYLE_TYPE.TABLE))
+    tblW = etree.SubElement(tblPr, W('tblW'))
+    tblW.set(W('type'), 'auto')
+    tblW.set(W('w'), '0')
+    look = etree.SubElement(tblPr, W('tblLook'))
+    for attr, val in (('firstColumn', '1'), ('firstRow', '1'), ('lastColumn', '0'),
+                      ('lastRow', '0'), ('noHBand', '0'), ('noVBand', '1'), ('val', '04A0')):
+        look.set(W(attr), val)
+    grid = etree.SubElement(tbl, W('tblGrid'))
+    for _ in range(ncols):
+        etree.SubElement(grid, W('gridCol')).set(W('w'), width)
+
+    layout = (ncols, width, paragraph_style(body, 'MD Table'))
+    for row_idx, row_data in enumerate(rows):
+        _table_row(tbl, row_data, layout, row_idx == 0, stats)
+
+    body.table_layout = layout
+    body.append(tbl)
+    return tbl
+
+def add_table_rows(body, rows, stats=None):
+    """续接上一张表格的后续行 (超长表格分段时): 沿用其列数与列宽, 多出的单元格被忽略"""
+    if body.table_layout is None:
+        add_markdown_table(body, rows, stats)
+        return
+    holder = etree.Element(W('tbl'), nsmap={'w': WORD_NS})
+    for row_data in rows:
+        _table_row(holder, row_data, body.table_layout, False, stats)
+    body.extend_table(list(holder))
+
+# ===== Streaming Writer =====
+# 可选的输出后端: word/document.xml 边解析边写入 .docx 压缩包, 文档树中
+# 始终只保留当前块; 其余部件 (样式、编号等) 从模板原样复制。
+STREAM_BATCH_BLOCKS = 256  # 每次序列化写出的块数
+
+class StreamingBody(BodyBuilder):
+    """流式正文, 接口与 BodyBuilder 相同; 块按批序列化后写入 stream 并释放
+
+    块暂存在一个声明了 w/m 命名空间的临时 body 下 (子元素上多余的 xmlns
+    声明由 lxml 合并掉), 攒满一批后整体序列化一次, 去掉临时 body 的首尾标签
+    即为 document.xml 中的正文片段。最后追加的块要等下一个块追加 (或 close)
+    时才写出, 因此 add_paragraph 等返回的对象在追加后仍可继续填充。
+    """
+
+    def __init__(self, doc, stream):
+        super().__init__(doc)
+        self._stream = stream
+        self._holder = etree.Element(W('body'), nsmap=NSMAP)
+        self._rows = None  # 正在续写的表格的行容器
+
+    def append(self, elem):
+        self._close_table()
+        if len(self._holder) >= STREAM_BATCH_BLOCKS:
+            self._write_pending()
+        self._holder.append(elem)
+        return elem
+
+    def extend_table(self, rows):
+        """续写最后追加的表格: 写出表格开头, 此后各段的行直接写出, 不在内存中积累"""
+        if self._rows is None:
+            data = etree.tostring(self._holder, encoding='UTF-8')
+            self._stream.write(data[data.index(b'>') + 1:-len(b'</w:tbl></w:body>')])
+            del self._holder[:]
+            self._rows = etree.Element(W('tbl'), nsmap=NSMAP)
+        if rows:
+            self._rows.extend(rows)
+            data = etree.tostring(self._rows, encoding='UTF-8')
+            self._stream.write(data[data.index(b'>') + 1:-len(b'</w:tbl>')])
+            del self._rows[:]
+
+    def _close_table(self):
+        if self._rows is not None:
+            self._stream.write(b'</w:tbl>')
+            self._rows = None
+
+    def _write_pending(self):
+        if not len(self._holder):
+            return
+        data = etree.tostring(self._holder, encoding='UTF-8')
+        self._stream.write(data[data.index(b'>') + 1:-len(b'</w:body>')])
+        del self._holder[:]
+
+    def close(self):
+        self._close_table()
+        self._write_pending()
+
+def _split_document_xml(doc):
+    """把模板的 document.xml 在正文末尾 (sectPr 之前) 拆成前后两段"""
+    xml = etree.tostring(doc.element, encoding='UTF-8', standalone=True)
+    cut = xml.rfind(b'<w:sectPr')
+    if cut < 0:
+        cut = xml.rfind(b'</w:body>')
+    return xml[:cut], xml[cut:]
+
+def write_docx_streaming(doc, blocks, output_file, stats, template=None, fragments=None):
+    """以 doc 为模板, 把 Block 事件流直接写成 .docx 文件
+
+    template 为 doc 所基于的 .docx 包字节, 省略时把 doc 另存一份得到。
+    """
+    import zipfile
+
+    if template is None:
+        buf = io.BytesIO()
+        doc.save(buf)
+        template = buf.getvalue()
+    head, tail = _split_document_xml(doc)
+    try:
+        with zipfile.ZipFile(io.BytesIO(template)) as zin, \
+                zipfile.ZipFile(output_file, 'w', zipfile.ZIP_DEFLATED) as zout:
+            for item in zin.infolist():
+                if item.filename != 'word/document.xml':
+                    zout.writestr(item, zin.read(item))
+                    continue
+                with zout.open(item.filename, 'w') as stream:
+                    stream.write(head)
+                    body = StreamingBody(doc, stream)
+                    render_blocks(body, blocks, stats, fragments)
+                    body.close()
+                    stream.write(tail)
+    except BaseException:
+        # 不留下写了一半的文件 (写入文件对象时由调用方处理)
+        if isinstance(output_file, (str, os.PathLike)):
+            Path(output_file).unlink(missing_ok=True)
+        raise
+
+# ===== Bounded Memory =====
+# 低内存模式: 输入经 mmap 逐行读取 (已读过的页随即释放), 正文流式写出,
+# 超长表格分段解析与写出, 并定期检查常驻内存是否超过上限。
+TABLE_CHUNK_ROWS = 512        # 低内存模式下表格每段的行数
+MEMORY_CHECK_BLOCKS = 256     # 每隔多少块检查一次常驻内存
+MAPPED_RELEASE_BYTES = 16 * 1024 * 1024  # 已读过的映射每积累这么多字节释放一次
+
+class MappedLines:
+    """用 mmap 逐行读取 UTF-8 文本文件, 产生的行与文本模式打开文件相同 (统一换行符)
+
+    可多次迭代。已读过的页会及时交还系统 (madvise), 不计入本进程的常驻内存。
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        import mmap
+
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return  # 空文件不能映射
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                release = getattr(mm, 'madvise', None) and getattr(mmap, 'MADV_DONTNEED', None)
+                released = 0
+                for raw in iter(mm.readline, b''):
+                    line = raw.decode('utf-8')
+                    if '\r' in line:
+                        yield from line.replace('\r\n', '\n').replace('\r', '\n').splitlines(True)
+                    else:
+                        yield line
+                    if release is not None and mm.tell() - released >= MAPPED_RELEASE_BYTES:
+                        end = mm.tell() - mm.tell() % mmap.PAGESIZE
+                        mm.madvise(mmap.MADV_DONTNEED, released, end - released)
+                        released = end
+
+def current_rss():
+    """本进程当前的常驻内存 (字节); 无法读取时 (非Linux) 以峰值代替, 都不支持时返回 None"""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return peak_rss()
+
+def limit_memory(blocks, limit):
+    """透传 Block 事件流, 每隔 MEMORY_CHECK_BLOCKS 块检查常驻内存
+
+    超过 limit (字节) 时先清空内存公式缓存并回收垃圾, 仍然超过则抛出 MemoryError。
+    """
+    import gc
+
+    for count, block in enumerate(blocks, 1):
+        if count % MEMORY_CHECK_BLOCKS == 0 or block.kind == BLOCK_TABLE_ROWS:
+            rss = current_rss()
+            if rss is not None and rss > limit:
+                FORMULA_CACHE.clear()
+                gc.collect()
+                rss = current_rss()
+                if rss > limit:
+                    raise MemoryError(f"内存占用 {rss / 2**20:.0f} MB 超过上限 "
+                                      f"{limit / 2**20:.0f} MB (第 {block.lineno} 行附近)")
+        yield block
+
+# ===== Split Output =====
+# 超大文档拆成多个 .docx: 每部分使用独立的文档树, 写完即释放,
+# 全部完成后写出清单 (JSON), 列出各部分的文件、起始行号与标题。
+SPLIT_COLLECT_BLOCKS = 2000  # 每写出这么多块主动回收一次已写完部分的文档树
+
+class SplitRule:
+    """拆分规则: 在 heading 级以内的标题前 (1: 只在 # 前, 2: # 与 ## 前, 0: 不按标题)
+    开始新的部分; 当前部分已有 max_blocks 个块或块内文本已达 max_chars 个字符时也开始新部分
+
+    只有标题的部分不会在下一个标题前拆开; 超长表格的后续行总与表格在同一部分。
+    """
+
+    def __init__(self, heading=2, max_blocks=None, max_chars=None):
+        if heading not in (0, 1, 2):
+            raise ValueError(f"拆分的标题级别必须为 0、1 或 2, 实际为 {heading}")
+        self.heading = heading
+        self.max_blocks = max_blocks
+        self.max_chars = max_chars
+
+    def starts_part(self, block, blocks, chars, has_body):
+        """block 是否应该开始新的部分; blocks/chars 为当前部分已有的块数与字符数"""
+        if not blocks or block.kind == BLOCK_TABLE_ROWS:
+            return False
+        if block.kind == BLOCK_HEADING and block.data[0] < self.heading and has_body:
+            return True
+        if self.max_blocks and blocks >= self.max_blocks:
+            return True
+        return bool(self.max_chars) and chars >= self.max_chars
+
+def _block_chars(block):
+    if block.kind == BLOCK_HEADING:
+        return len(block.data[1])
+    if block.kind == BLOCK_TABLE or block.kind == BLOCK_TABLE_ROWS:
+        return sum(len(cell) for row in block.data for cell in row)
+    return len(block.data)
+
+def iter_parts(blocks, rule):
+    """按拆分规则把 Block 事件流切成若干部分, 依次产生每部分的 Block 迭代器
+
+    每部分的迭代器须在取下一部分之前用完。
+    """
+    blocks = iter(blocks)
+    pending = [next(blocks, None)]
+
+    def part():
+        count = chars = 0
+        has_body = False
+        block = pending[0]
+        while block is not None and not rule.starts_part(block, count, chars, has_body):
+            yield block
+            count += 1
+            chars += _block_chars(block)
+            has_body = has_body or block.kind != BLOCK_HEADING
+            block = next(blocks, None)
+        pending[0] = block
+
+    while pending[0] is not None:
+        yield part()
+
+def split_output_paths(output_file):
+    """拆分输出时的 (部分文件名生成函数, 清单路径): 报告.docx → 报告-001.docx …, 报告.parts.json"""
+    output_file = Path(output_file)
+    return (lambda n: output_file.with_name(f"{output_file.stem}-{n:03d}{output_file.suffix}"),
+            output_file.with_suffix('.parts.json'))
+
+def _write_parts(blocks, output_file, stats, rule, streaming):
+    """把 Block 事件流拆成多个 .docx 依次写出, 最后写出清单, 返回各部分的信息列表"""
+    import gc
+    import json
+
+    part_path, manifest_path = split_output_paths(output_file)
+    parts = []
+    uncollected = 0
+    for n, part_blocks in enumerate(iter_parts(blocks, rule), 1):
+        info = {'file': part_path(n).name, 'first_line': None, 'title': None, 'blocks': 0}
+        before = (stats['block'], stats['inline'])
+
+        def track(part_blocks=part_blocks, info=info):
+            for block in part_blocks:
+                if info['first_line'] is None:
+                    info['first_line'] = block.lineno
+                if info['title'] is None and block.kind == BLOCK_HEADING:
+                    info['title'] = block.data[1]
+                info['blocks'] += 1
+                yield block
+
+        doc = _checkout_document()
+        if streaming:
+            write_docx_streaming(doc, track(), str(part_path(n)), stats, template_bytes(doc))
+        else:
+            render_blocks(BodyBuilder(doc), track(), stats)
+            _save_document(doc, str(part_path(n)))
+        # 释放已写完部分的文档树: python-docx 的文档对象间有循环引用, 而 lxml
+        # 占用的内存不会触发垃圾回收; 完整回收较慢, 因此每写出一定块数回收一次
+        del doc
+        uncollected += info['blocks']
+        if uncollected >= SPLIT_COLLECT_BLOCKS:
+            gc.collect()
+            uncollected = 0
+        info['block'] = stats['block'] - before[0]
+        info['inline'] = stats['inline'] - before[1]
+        parts.append(info)
+
+    manifest = {'parts': parts, 'block': stats['block'], 'inline': stats['inline']}
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return parts
+
+# ===== Incremental Rebuild =====
+# 反复转换同一文档 (如 --watch) 时, 以 Block 内容为键缓存该块生成的正文元素,
+# 只重新生成内容有变化的块。块的输出只取决于其内容与转换设置, 与位置无关。
+WATCH_INTERVAL = 0.1  # --watch 轮询输入文件的间隔 (秒)
+
+def _block_key(block):
+    kind, data = block.kind, block.data
+    if kind == BLOCK_TABLE:
+        data = tuple(tuple(row) for row in data)
+    return kind, data
+
+class FragmentCache:
+    """块级片段缓存: {块内容: (正文元素列表, 独立公式数, 行内公式数)}
+
+    缓存的是上次生成的元素本身, 复用时直接移入新文档而不复制,
+    因此用同一缓存生成的上一个文档此后不应再使用 (转换函数保存后即丢弃, 不受影响)。
+    每次转换后只保留本次用到的块, 内存占用与文档本身相当;
+    模板或数学识别设置变化时自动清空。同一时刻只应被一个转换使用。
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._used = {}
+        self._config = None
+
+    def __len__(self):
+        return len(self._data)
+
+    def begin(self):
+        config = (TEMPLATE_PATH, MATH_PATTERNS, MATH_TRIGGERS, LATEX_OPERATORS, LATEX_MACROS)
+        if config != self._config:
+            self._data.clear()
+            self._config = config
+        self._used = {}
+
+    def take(self, key):
+        """取出块的元素列表与公式数; 同一转换中再次出现的相同块得到副本"""
+        entry = self._used.get(key)
+        if entry is not None:
+            return [copy.deepcopy(e) for e in entry[0]], entry[1], entry[2]
+        entry = self._data.get(key)
+        if entry is not None:
+            self._used[key] = entry
+        return entry
+
+    def put(self, key, entry):
+        self._data[key] = self._used[key] = entry
+
+    def sweep(self):
+        """丢弃本次转换未用到的块"""
+        self._data = self._used
+        self._used = {}
+
+class _CaptureBody:
+    """转发到 body 的同时记下追加的元素"""
+
+    def __init__(self, body):
+        self._body = body
+        self.doc = body.doc
+        self.elements = []
+
+    def append(self, elem):
+        self.elements.append(elem)
+        return self._body.append(elem)
+
+    def style_id(self, style, style_type=None):
+        return self._body.style_id(style, style_type)
+
+def _render_incremental(body, blocks, stats, fragments):
+    fragments.begin()
+    stats['blocks_reused'] = stats['blocks_rendered'] = 0
+    for block in blocks:
+        key = _block_key(block)
+        entry = fragments.take(key)
+        if entry is None:
+            capture = _CaptureBody(body)
+            block_count, inline_count = stats['block'], stats['inline']
+            _render_block(capture, block, stats)
+            fragments.put(key, (capture.elements, stats['block'] - block_count,
+                                stats['inline'] - inline_count))
+            stats['blocks_rendered'] += 1
+        else:
+            elements, block_count, inline_count = entry
+            for elem in elements:
+                body.append(elem)
+            stats['block'] += block_count
+            stats['inline'] += inline_count
+            stats['blocks_reused'] += 1
+    fragments.sweep()
+
+def watch_file(input_file, output_file=None, streaming=False, interval=WATCH_INTERVAL,
+               on_result=None):
+    """监视输入文件, 每次保存后增量重建 .docx, 直到 KeyboardInterrupt
+
+    先写入同目录的临时文件再替换输出文件, 打开中的输出不会看到写了一半的内容。
+    每次重建后以与批量转换相同格式的结果字典调用 on_result(result)。
+    """
+    input_path = Path(input_file)
+    output_path = Path(output_file) if output_file else input_path.with_suffix('.docx')
+    tmp_path = output_path.with_name(f'.{output_path.name}.tmp')
+    fragments = FragmentCache()
+    last = None
+    while True:
+        try:
+            st = input_path.stat()
+            current = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            current = None  # 编辑器保存时可能先删除再重新写入
+        if current is not None and current != last:
+            last = current
+            start = time.perf_counter()
+            result = {'input': str(input_file), 'output': None, 'stats': None, 'error': None}
+            try:
+                stats, _ = convert_md_to_docx(input_path, tmp_path, streaming=streaming,
+                                              fragments=fragments)
+                os.replace(tmp_path, output_path)
+                result['output'] = str(output_path)
+                result['stats'] = stats
+            except Exception as e:
+                tmp_path.unlink(missing_ok=True)
+                result['error'] = f"{type(e).__name__}: {e}"
+            result['time'] = time.perf_counter() - start
+            if on_result is not None:
+                on_result(result)
+        time.sleep(interval)
+
+# ===== Profiling =====
+# 剖析时把下列模块级函数临时替换为计时包装 (模块内部按全局名调用它们),
+# 转换结束后换回原函数, 因此不剖析时没有任何额外开销。
+# 包装只记录开启了剖析的线程, 其他线程中的转换直接调用原函数。
+PROFILE_TOP_FORMULAS = 10
+
+_PROFILE_HOOKS = (
+    # (函数名, 阶段名, 是否为生成器)
+    ('_checkout_document', 'template', False),
+    ('iter_blocks', 'parse', True),
+    ('collect_formulas', 'collect', False),
+    ('prefetch_formulas', 'prefetch', False),
+    ('_render_block', 'render', False),
+    ('tokenize_inline', 'tokenize', True),
+    ('latex_to_omml', 'formula', False),
+    ('preprocess_latex', 'preprocess', False),
+    ('latex_to_mathml_tree', 'latex2mathml', False),
+    ('mathml_to_omml', 'mathml_to_omml', False),
+    ('_save_document', 'save', False),
+    ('write_docx_streaming', 'write', False),
+)
+_PROFILE_LOCK = threading.Lock()
+_PROFILE_USERS = 0
+_PROFILE_ORIGINALS = {}
+_PROFILE_LOCAL = threading.local()
+
+class Profile:
+    """一次转换的剖析结果: 各阶段耗时与调用次数、最慢的公式及其行号、峰值内存
+
+    阶段耗时分为含子阶段的 seconds 与不含子阶段的 self_seconds,
+    例如 render 的 self_seconds 即构建 WordprocessingML 本身的耗时。
+    memory 为 True 时另用 tracemalloc 统计 Python 对象的峰值内存;
+    它会使转换慢一个数量级, 此时各阶段耗时只有相对意义。
+    """
+
+    def __init__(self, top=PROFILE_TOP_FORMULAS, memory=False):
+        self.top = top
+        self.memory = memory
+        self.stages = {}      # 阶段名: [调用次数, 耗时, 自身耗时]
+        self.formulas = []    # 最慢公式的小顶堆: (耗时, 序号, LaTeX, 行号)
+        self.lineno = None    # 当前正在生成的块的起始行号
+        self.total = 0.0
+        self.peak_memory = None
+        self._stack = []
+        self._seq = 0
+
+    def enter(self, stage):
+        self._stack.append([stage, time.perf_counter(), 0.0])
+
+    def leave(self):
+        stage, start, child = self._stack.pop()
+        elapsed = time.perf_counter() - start
+        entry = self.stages.get(stage)
+        if entry is None:
+            entry = self.stages[stage] = [0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] += elapsed - child
+        if self._stack:
+            self._stack[-1][2] += elapsed
+        return elapsed
+
+    def call(self, stage, func, args, kwargs):
+        if stage == 'render':
+            self.lineno = args[1].lineno
+        self.enter(stage)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = self.leave()
+            if stage == 'formula':
+                self._note_formula(args[0], elapsed)
+
+    def iterate(self, stage, iterator):
+        """逐项计时的生成器: 只计入产生每一项的耗时, 不含调用方处理该项的时间"""
+        while True:
+            self.enter(stage)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.leave()
+            yield item
+
+    def _note_formula(self, latex_str, elapsed):
+        import heapq
+        self._seq += 1
+        item = (elapsed, self._seq, latex_str, self.lineno)
+        if len(self.formulas) < self.top:
+            heapq.heappush(self.formulas, item)
+        elif elapsed > self.formulas[0][0]:
+            heapq.heapreplace(self.formulas, item)
+
+    def to_dict(self):
+        result = {
+            'total_seconds': round(self.total, 6),
+            'stages': {stage: {'calls': calls, 'seconds': round(seconds, 6),
+                               'self_seconds': round(own, 6)}
+                       for stage, (calls, seconds, own) in
+                       sorted(self.stages.items(), key=lambda kv: -kv[1][1])},
+            'slowest_formulas': [{'latex': latex_str, 'line': lineno, 'seconds': round(elapsed, 6)}
+                                 for elapsed, _, latex_str, lineno in sorted(self.formulas, reverse=True)],
+        }
+        if self.peak_memory is not None:
+            result['peak_memory_bytes'] = self.peak_memory
+        rss = peak_rss()
+        if rss is not None:
+            result['peak_rss_bytes'] = rss
+        return result
+
+def peak_rss():
+    """本进程至今的峰值常驻内存 (字节); 不支持的平台返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位, macOS 以字节为单位
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def _timed(stage, func, iterator):
+    if iterator:
+        def wrapper(*args, **kwargs):
+            profile = getattr(_PROFILE_LOCAL, 'profile', None)
+            if profile is None:
+                return func(*args, **kwargs)
+            return profile.iterate(stage, func(*args, **kwargs))
+    else:
+        def wrapper(*args, **kwargs):
+            profile = getattr(_PROFILE_LOCAL, 'profile', None)
+            if profile is None:
+                return func(*args, **kwargs)
+            return profile.call(stage, func, args, kwargs)
+    return wrapper
+
+def _install_profile_hooks():
+    global _PROFILE_USERS
+    with _PROFILE_LOCK:
+        if _PROFILE_USERS == 0:
+            module = globals()
+            for name, stage, iterator in _PROFILE_HOOKS:
+                _PROFILE_ORIGINALS[name] = module[name]
+                module[name] = _timed(stage, module[name], iterator)
+        _PROFILE_USERS += 1
+
+def _remove_profile_hooks():
+    global _PROFILE_USERS
+    with _PROFILE_LOCK:
+        _PROFILE_USERS -= 1
+        if _PROFILE_USERS == 0:
+            globals().update(_PROFILE_ORIGINALS)
+            _PROFILE_ORIGINALS.clear()
+
+def _convert_profiled(profile, source, output, streaming, formula_jobs, fragments, low_memory,
+                      split):
+    """在剖析下执行 _convert_lines, 结果放入 stats['profile']
+
+    profile 为 Profile 对象、Profile 的参数字典或 True。
+    """
+    import tracemalloc
+
+    if isinstance(profile, dict):
+        profile = Profile(**profile)
+    elif not isinstance(profile, Profile):
+        profile = Profile()
+    started_tracing = False
+    if profile.memory:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started_tracing = True
+        tracemalloc.reset_peak()
+    _install_profile_hooks()
+    _PROFILE_LOCAL.profile = profile
+    start = time.perf_counter()
+    try:
+        stats = _convert_lines(source, output, streaming, formula_jobs, fragments,
+                               low_memory=low_memory, split=split)
+    finally:
+        profile.total = time.perf_counter() - start
+        _PROFILE_LOCAL.profile = None
+        _remove_profile_hooks()
+        if profile.memory:
+            profile.peak_memory = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+    stats['profile'] = profile.to_dict()
+    return stats
+
+# ===== Main Conversion =====
+def _render_block(body, block, stats):
+    kind, data = block.kind, block.data
+    if kind == BLOCK_PARAGRAPH:
+        is_bold = data.startswith('**') and '**' in data[2:]
+        process_text_with_math(body, data, indent=True, bold=is_bold, stats=stats)
+    elif kind == BLOCK_HEADING:
+        add_heading(body, data[1], level=data[0])
+    elif kind == BLOCK_FORMULA:
+        stats['block'] += 1
+        add_formula_paragraph(body, data, stats)
+    elif kind == BLOCK_TABLE:
+        add_markdown_table(body, data, stats)
+    elif kind == BLOCK_TABLE_ROWS:
+        add_table_rows(body, data, stats)
+    elif kind == BLOCK_BULLET:
+        add_bullet(body, data, stats)
+
+def render_blocks(body, blocks, stats, fragments=None):
+    """把 Block 事件流写入文档正文; 给出 fragments (FragmentCache) 时复用未变化块的片段"""
+    if fragments is not None:
+        _render_incremental(body, blocks, stats, fragments)
+        return
+    for block in blocks:
+        _render_block(body, block, stats)
+
+def _save_document(doc, output):
+    doc.save(output)
+
+def _convert_lines(source, output, streaming=False, formula_jobs=None, fragments=None,
+                   profile=None, low_memory=None, split=None):
+    """把 Markdown 文本行来源转换为 .docx, 写入 output (路径或二进制文件对象), 返回统计信息
+
+    split 为 SplitRule 时 output 须为路径, 拆分写出各部分与清单, 各部分的信息见 stats['parts']。
+    """
+    if profile:
+        return _convert_profiled(profile, source, output, streaming, formula_jobs, fragments,
+                                 low_memory, split)
+    if (low_memory or split is not None) and fragments is not None:
+        raise ValueError("低内存模式与拆分输出不支持增量重建")
+    doc = _checkout_document() if split is None else None  # 拆分时每部分各自取一份
+    stats = {'block': 0, 'inline': 0, 'cache_hits': 0, 'disk_hits': 0, 'cache_misses': 0}
+    table_chunk = TABLE_CHUNK_ROWS if low_memory else None
+    if formula_jobs is not None and formula_jobs != 1:
+        # 流水线模式需要读两遍: 可定位的来源回到起点, MappedLines 可再次迭代, 否则先读入内存
+        if getattr(source, 'seekable', None) and source.seekable():
+            start = source.tell()
+            formulas = collect_formulas(iter_blocks(source, table_chunk))
+            source.seek(start)
+        else:
+            if not isinstance(source, MappedLines):
+                source = list(source)
+            formulas = collect_formulas(iter_blocks(source, table_chunk))
+        _PREFETCHED.omml = prefetch_formulas(formulas, formula_jobs)
+    blocks = iter_blocks(source, table_chunk)
+    if low_memory and low_memory is not True:
+        blocks = limit_memory(blocks, low_memory)
+    cancel = getattr(_CANCEL_LOCAL, 'event', None)
+    if cancel is not None:
+        blocks = _check_cancel(blocks, cancel)
+    try:
+        if split is not None:
+            stats['parts'] = _write_parts(blocks, output, stats, split, streaming or low_memory)
+        elif streaming or low_memory:
+            write_docx_streaming(doc, blocks, output, stats, template_bytes(doc), fragments)
+        else:
+            render_blocks(BodyBuilder(doc), blocks, stats, fragments)
+            _save_document(doc, output)
+    finally:
+        _PREFETCHED.omml = None
+
+    if DISK_CACHE is not None:
+        DISK_CACHE.flush()
+    if low_memory:
+        stats['peak_rss_bytes'] = peak_rss()
+    return stats
+
+def convert_md_to_docx(input_file, output_file=None, streaming=False, formula_jobs=None,
+                       fragments=None, profile=None, low_memory=None, split=None):
+    """主转换函数
+
+    streaming 为 True 时使用流式后端: 正文边解析边写入输出文件,
+    内存占用与文档长度无关, 输出与默认后端相同。
+    formula_jobs 大于1时启用流水线模式: 先收集全部公式, 用该数量的进程并行转换,
+    再构建文档 (0 表示使用全部CPU核)。
+    fragments 为 FragmentCache 时增量重建: 同一文档再次转换时只重新生成有变化的块。
+    profile 为 True、Profile 的参数字典 (如 {'memory': True}) 或 Profile 对象时
+    剖析本次转换, 结果见 stats['profile']。
+    low_memory 为 True 或内存上限 (字节) 时使用低内存模式: 经 mmap 读取输入、流式写出、
+    超长表格分段处理, 常驻内存超过上限时抛出 MemoryError; stats['peak_rss_bytes']
+    为本进程的峰值常驻内存。
+    split 为 True、SplitRule 的参数字典 (如 {'heading': 1, 'max_blocks': 5000}) 或
+    SplitRule 对象时拆分输出: 写出 输出-001.docx、输出-002.docx … 与清单 输出.parts.json,
+    返回的输出路径为清单路径。
+    """
+    input_path = Path(input_file)
+    if not input_path.exists():
+        raise FileNotFoundError(f"文件不存在: {input_file}")
 
-        process_text_with_math(doc, text, indent=True, bold=is_bold, stats=stats)
-        i += 1
+    if output_file is None:
+        output_file = input_path.with_suffix('.docx')
+    if split:
+        if isinstance(split, dict):
+            split = SplitRule(**split)
+        elif not isinstance(split, SplitRule):
+            split = SplitRule()
+    else:
+        split = None
 
-    doc.save(str(output_file))
+    if low_memory:
+        stats = _convert_lines(MappedLines(input_file), str(output_file), streaming, formula_jobs,
+                               fragments, profile, low_memory, split)
+    else:
+        with open(input_file, 'r', encoding='utf-8') as f:
+            stats = _convert_lines(f, str(output_file), streaming, formula_jobs, fragments,
+                                   profile, split=split)
+    if split is not None:
+        return stats, split_output_paths(output_file)[1]
     return stats, output_file
 
+def convert_md_to_stream(source, output_stream, streaming=False, formula_jobs=None,
+                         fragments=None, profile=None, low_memory=None):
+    """在内存中转换, 不读写文件
+
+    source 为 Markdown 字符串、UTF-8 字节或文本流 (二进制流按UTF-8解码),
+    .docx 写入二进制文件对象 output_stream (BytesIO、socket.makefile('wb') 等,
+    不要求可定位)。返回与 convert_md_to_docx 相同的统计信息。
+    出错时 output_stream 中可能已有部分数据, 由调用方丢弃。
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = bytes(source).decode('utf-8')
+    if isinstance(source, str):
+        # 与按文本模式打开文件一致, 统一换行符
+        source = io.StringIO(source, newline=None)
+    elif isinstance(source, (io.RawIOBase, io.BufferedIOBase)):
+        wrapper = io.TextIOWrapper(source, encoding='utf-8')
+        try:
+            return _convert_lines(wrapper, output_stream, streaming, formula_jobs, fragments,
+                                  profile, low_memory)
+        finally:
+            wrapper.detach()  # 不随包装对象一起关闭调用方的流
+    return _convert_lines(source, output_stream, streaming, formula_jobs, fragments, profile,
+                          low_memory)
+
 # ===== GUI =====
 def select_file():
     """打开文件选择对话框"""
+    import tkinter as tk
+    from tkinter import filedialog
     root = tk.Tk()
     root.withdraw()
     file_path = filedialog.askopenfilename(
@@ -738,6 +2278,8 @@ def select_file():
 
 def show_result(success, message):
     """显示结果对话框"""
+    import tkinter as tk
+    from tkinter import messagebox
     root = tk.Tk()
     root.withdraw()
     if success:
@@ -746,41 +2288,805 @@ def show_result(success, message):
         messagebox.showerror("转换失败", message)
     root.destroy()
 
-def main():
-    """主入口"""
-    # 判断是否命令行模式
-    cli_mode = len(sys.argv) > 1
+def show_warning(message):
+    """显示警告对话框 (转换继续进行)"""
+    import tkinter as tk
+    from tkinter import messagebox
+    root = tk.Tk()
+    root.withdraw()
+    messagebox.showwarning("警告", message)
+    root.destroy()
 
-    # 获取输入文件
-    if cli_mode:
-        input_file = sys.argv[1]
+# ===== Batch Conversion =====
+def collect_markdown_files(inputs):
+    """展开文件、目录 (递归查找*.md) 与通配符, 返回去重后的文件列表"""
+    files = []
+    seen = set()
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            matches = sorted(path.rglob('*.md'))
+        elif glob.has_magic(item):
+            matches = sorted(Path(p) for p in glob.glob(item, recursive=True) if Path(p).is_file())
+        else:
+            matches = [path]
+        for match in matches:
+            key = os.path.normcase(os.path.abspath(match))
+            if key not in seen:
+                seen.add(key)
+                files.append(match)
+    return files
+
+def _init_batch_worker(cache_path, cache_size, math_config, template_path, latex_settings):
+    """子进程初始化: 沿用主进程的缓存、数学识别、LaTeX预处理与模板设置"""
+    set_formula_cache_size(cache_size)
+    configure_math_detection(*math_config)
+    configure_latex(*latex_settings)
+    set_template(template_path)
+    if cache_path is not None:
+        try_disk_cache(cache_path)
+
+def _convert_one(input_file, streaming=False, output_file=None, profile=None, low_memory=None,
+                 split=None):
+    """转换单个文件, 异常作为结果返回以免中断整批任务"""
+    start = time.perf_counter()
+    result = {'input': str(input_file), 'output': None, 'stats': None, 'error': None}
+    try:
+        if Path(input_file).suffix.lower() != '.md':
+            raise ValueError("不是.md文件")
+        stats, output_file = convert_md_to_docx(input_file, output_file, streaming=streaming,
+                                                profile=profile, low_memory=low_memory,
+                                                split=split)
+        result['output'] = str(output_file)
+        result['stats'] = stats
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['time'] = time.perf_counter() - start
+    return result
+
+def convert_batch(inputs, jobs=None, on_result=None, streaming=False, profile=None,
+                  low_memory=None, split=None):
+    """批量转换: 用进程池并行执行 convert_md_to_docx
+
+    inputs 可包含文件、目录与通配符; on_result(result) 在每个文件完成时回调。
+    profile 为 True 或 Profile 的参数字典时剖析每个文件, 结果见各自的 stats['profile']。
+    low_memory 同 convert_md_to_docx, 内存上限对每个工作进程分别生效; split 同 convert_md_to_docx。
+    返回 (每个文件的结果列表, 汇总统计)。
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    files = collect_markdown_files(inputs)
+    jobs = jobs or os.cpu_count() or 1
+    results = []
+
+    def finish(result):
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+
+    if jobs == 1 or len(files) <= 1:
+        for f in files:
+            finish(_convert_one(f, streaming, profile=profile, low_memory=low_memory, split=split))
     else:
-        input_file = select_file()
-        if not input_file:
-            return
+        cache_path = DISK_CACHE.path if DISK_CACHE is not None else None
+        with ProcessPoolExecutor(max_workers=min(jobs, len(files)),
+                                 initializer=_init_batch_worker,
+                                 initargs=(cache_path, FORMULA_CACHE.maxsize,
+                                           (MATH_PATTERNS, MATH_TRIGGERS),
+                                           TEMPLATE_PATH, latex_config())) as pool:
+            futures = {pool.submit(_convert_one, f, streaming, None, profile, low_memory, split): f
+                       for f in files}
+            for future in as_completed(futures):
+                try:
+                    finish(future.result())
+                except Exception as e:
+                    # 子进程异常退出 (如内存耗尽) 时只记录该文件失败
+                    finish({'input': str(futures[future]), 'output': None, 'stats': None,
+                            'error': f"{type(e).__name__}: {e}", 'time': 0.0})
+
+    totals = {'files': len(results), 'succeeded': 0, 'failed': 0}
+    for result in results:
+        if result['error'] is not None:
+            totals['failed'] += 1
+            continue
+        totals['succeeded'] += 1
+        for key, value in result['stats'].items():
+            if key == 'peak_rss_bytes' and value is not None:
+                totals[key] = max(totals.get(key, 0), value)
+            elif isinstance(value, (int, float)):
+                totals[key] = totals.get(key, 0) + value
+    return results, totals
+
+def write_profile(path, data):
+    """把剖析结果写成 JSON 文件"""
+    import json
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    print(f"剖析结果已写入: {path}")
+
+def run_batch(inputs, jobs=None, streaming=False, profile_path=None, profile=True,
+              low_memory=None, split=None):
+    """命令行批量模式: 逐个打印结果并输出汇总, 有失败时返回1"""
+    start = time.perf_counter()
+    done = [0]
+
+    def report(result):
+        done[0] += 1
+        if result['error'] is None:
+            stats = result['stats']
+            print(f"[{done[0]}] {result['input']} -> {result['output']} "
+                  f"(独立公式: {stats['block']}, 行内公式: {stats['inline']}, {result['time']:.2f}s)")
+        else:
+            print(f"[{done[0]}] {result['input']} 转换出错: {result['error']}")
+
+    results, totals = convert_batch(inputs, jobs, on_result=report, streaming=streaming,
+                                    profile=profile if profile_path else None,
+                                    low_memory=low_memory, split=split)
+    if not results:
+        print("错误: 没有找到.md文件!")
+        return 1
+    print(f"批量转换完成: 成功 {totals['succeeded']} 个, 失败 {totals['failed']} 个, "
+          f"用时 {time.perf_counter() - start:.2f}s")
+    print(f"独立公式: {totals.get('block', 0)}\n行内公式: {totals.get('inline', 0)}\n"
+          f"总计: {totals.get('block', 0) + totals.get('inline', 0)}")
+    if profile_path:
+        write_profile(profile_path, {'files': results, 'totals': totals})
+    return 1 if totals['failed'] else 0
+
+# ===== Formula Check =====
+def check_formula(latex_str):
+    """严格转换一个公式 (不经过缓存); 可以转换时返回 None, 否则返回异常说明
+
+    正常转换中这类异常被吞掉, 公式退化为 Cambria Math 斜体文本。
+    """
+    try:
+        mathml_to_omml(latex_to_mathml_tree(preprocess_latex(latex_str)))
+    except Exception as e:
+        return f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+    return None
+
+def _check_formula_chunk(latex_list):
+    return [(latex_str, check_formula(latex_str)) for latex_str in latex_list]
+
+def check_markdown(inputs, jobs=None, bare_math=False):
+    """检查文件中的公式能否转换, 不构建文档
+
+    inputs 与批量转换相同, 可包含文件、目录与通配符。先收集全部文件中的公式并去重,
+    再用 jobs 个进程并行严格转换。返回 (每个文件的报告, 汇总);
+    报告中每个失败给出行号、类型、公式与异常。
+    """
+    files = collect_markdown_files(inputs)
+    reports = []
+    occurrences = []
+    for path in files:
+        report = {'input': str(path), 'formulas': 0, 'failures': [], 'error': None}
+        found = []
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                found = list(iter_formulas(iter_blocks(f), bare_math))
+        except (OSError, UnicodeDecodeError) as e:
+            report['error'] = f"{type(e).__name__}: {e}"
+        reports.append(report)
+        occurrences.append(found)
+
+    unique = list(dict.fromkeys(
+        latex_str for found in occurrences for latex_str in
+        (normalize_latex(item[0]) for item in found) if latex_str))
+    jobs = jobs or os.cpu_count() or 1
+    if jobs <= 1 or len(unique) < PREFETCH_MIN_FORMULAS:
+        errors = dict(_check_formula_chunk(unique))
+    else:
+        errors = {}
+        for part in _map_formula_chunks(_check_formula_chunk, unique, jobs):
+            errors.update(part)
+
+    totals = {'files': len(reports), 'formulas': 0, 'unique': len(unique), 'failures': 0,
+              'errors': 0}
+    for report, found in zip(reports, occurrences):
+        for source, kind, lineno, cell in found:
+            latex_str = normalize_latex(source)
+            if not latex_str:
+                continue
+            report['formulas'] += 1
+            error = errors[latex_str]
+            if error is not None:
+                failure = {'line': lineno, 'kind': kind, 'latex': source, 'error': error}
+                if cell is not None:
+                    failure['cell'] = list(cell)
+                report['failures'].append(failure)
+        totals['formulas'] += report['formulas']
+        totals['failures'] += len(report['failures'])
+        totals['errors'] += report['error'] is not None
+    return reports, totals
+
+def run_check(inputs, jobs=None):
+    """命令行检查模式: 以 JSON 输出每个文件的失败公式, 有失败时返回1"""
+    import json
+    start = time.perf_counter()
+    reports, totals = check_markdown(inputs, jobs)
+    totals['time'] = round(time.perf_counter() - start, 3)
+    print(json.dumps({'files': reports, 'totals': totals}, ensure_ascii=False, indent=2))
+    if not reports:
+        print("错误: 没有找到.md文件!", file=sys.stderr)
+        return 1
+    return 1 if totals['failures'] or totals['errors'] else 0
+
+# ===== Conversion Server =====
+# 编辑器插件等频繁转换短文档的场景, 解释器启动与导入依赖的耗时超过转换本身。
+# 常驻服务保持模块、基础模板与公式缓存预热, 客户端通过 JSON 行协议提交转换任务:
+#   请求 {"token": 令牌, "input": 路径, "output": 路径(可选), "streaming": 布尔,
+#         "template": 路径(可选)}
+#   回复 与批量转换的单项结果相同, 另加 "ok"; 服务拒绝任务 (队列已满、模板不同) 时
+#        回复 {"ok": false, "refused": 原因}, 客户端应改为在本进程转换
+#   {"token": 令牌, "op": "ping"} 回复服务状态
+# 令牌在服务启动时随机生成, 写入只有当前用户可读的文件, 令牌不符、不是 JSON 或像
+# HTTP 请求的连接立即关闭。TCP 只监听本机回环地址, 且只写出 .docx 文件。
+SERVER_QUEUE_LIMIT = 32     # 正在转换之外最多排队的任务数
+SERVER_CONNECT_TIMEOUT = 1.0
+_HTTP_LINE_RE = re.compile(rb'^(?:[A-Z]+ \S+ HTTP/|(?:GET|POST|PUT|HEAD|DELETE|OPTIONS|PATCH|CONNECT|TRACE) |[\w-]+:)')
+
+def default_server_address():
+    """默认服务地址: 支持时为当前用户专属的 Unix socket, 否则为本机TCP端口"""
+    import socket
+    import tempfile
+    if hasattr(socket, 'AF_UNIX'):
+        uid = os.getuid() if hasattr(os, 'getuid') else 0
+        return os.path.join(tempfile.gettempdir(), f'md2docx-{uid}.sock')
+    return '127.0.0.1:47321'
+
+def _server_address(address):
+    """'主机:端口' 为TCP地址, 其余为 Unix socket 路径; 返回 (地址族, socket地址)"""
+    import socket
+    match = re.fullmatch(r'([\w.\-]*):(\d+)', address)
+    if match:
+        host = match.group(1) or '127.0.0.1'
+        return socket.AF_INET, ('127.0.0.1' if host == 'localhost' else host, int(match.group(2)))
+    return socket.AF_UNIX, os.path.abspath(address)
+
+def _is_loopback(host):
+    import ipaddress
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def server_token_path(address=None):
+    """服务令牌文件: 位于当前用户的缓存目录, 按服务地址区分"""
+    family, addr = _server_address(address or default_server_address())
+    key = addr if isinstance(addr, str) else f"{addr[0]}:{addr[1]}"
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return default_cache_path().parent / f'server-{digest}.token'
+
+def _write_private(path, text):
+    """写出只有当前用户可读写的文件"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.chmod(path.parent, 0o700)
+    except OSError:
+        pass
+    fd = os.open(str(path), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.chmod(path, 0o600)
+
+def _check_output(input_file, output_file):
+    """服务只写出 .docx, 且不覆盖已有的非 .docx 文件; 不符合时抛出 ValueError"""
+    import zipfile
+    if not os.path.isabs(input_file) or (output_file and not os.path.isabs(output_file)):
+        raise ValueError("路径必须是绝对路径")
+    target = Path(output_file) if output_file else Path(input_file).with_suffix('.docx')
+    if target.suffix.lower() != '.docx':
+        raise ValueError(f"只能写出 .docx 文件: {target}")
+    if target.exists() and not (target.is_file() and zipfile.is_zipfile(target)):
+        raise ValueError(f"拒绝覆盖不是 .docx 的已有文件: {target}")
+
+def _same_template(path):
+    """请求中的模板与本进程当前模板是否相同"""
+    if not path or not TEMPLATE_PATH:
+        return not path and not TEMPLATE_PATH
+    return os.path.abspath(path) == os.path.abspath(TEMPLATE_PATH)
+
+def _init_server_worker(*args):
+    """服务工作进程初始化: 沿用服务进程的设置, 并预先导入依赖、准备模板"""
+    _init_batch_worker(*args)
+    convert_md_to_stream('$x$\n', io.BytesIO())
+
+class ConversionServer:
+    """常驻转换服务: 最多 jobs 个文档同时转换 (工作进程池), 另有至多 queue_limit 个排队,
+    超出时立即拒绝, 不让请求无限堆积"""
+
+    def __init__(self, address=None, jobs=None, queue_limit=SERVER_QUEUE_LIMIT):
+        self.address = address or default_server_address()
+        self.jobs = jobs or os.cpu_count() or 1
+        self.queue_limit = queue_limit
+        self._slots = threading.BoundedSemaphore(self.jobs + queue_limit)
+        self._active = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._pool = None
+        self._sock = None
+        self._token = None
+
+    def _new_pool(self):
+        from concurrent.futures import ProcessPoolExecutor
+        cache_path = DISK_CACHE.path if DISK_CACHE is not None else None
+        return ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_server_worker,
+                                   initargs=(cache_path, FORMULA_CACHE.maxsize,
+                                             (MATH_PATTERNS, MATH_TRIGGERS), TEMPLATE_PATH,
+                                             latex_config()))
+
+    def start(self):
+        """绑定地址并启动工作进程; 地址上已有服务在运行时抛出 OSError"""
+        import secrets
+        import socket
+        family, addr = _server_address(self.address)
+        if family != socket.AF_UNIX and not _is_loopback(addr[0]):
+            raise OSError(f"转换服务只能监听本机回环地址: {self.address}")
+        if family == socket.AF_UNIX and os.path.exists(addr):
+            # 上次异常退出留下的 socket 文件可以删除, 正在使用的则不行
+            probe = socket.socket(family, socket.SOCK_STREAM)
+            try:
+                probe.connect(addr)
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(addr)
+            else:
+                raise OSError(f"转换服务已在运行: {self.address}")
+            finally:
+                probe.close()
+
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            if family != socket.AF_UNIX and os.name != 'nt':
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(addr)
+            if family == socket.AF_UNIX:
+                os.chmod(addr, 0o600)
+            sock.listen(self.jobs + self.queue_limit)
+            sock.settimeout(0.5)  # 便于 close() 后退出 accept 循环
+            self._token = secrets.token_hex(32)
+            _write_private(server_token_path(self.address), self._token)
+        except BaseException:
+            sock.close()
+            raise
+        self._sock = sock
+
+        # 本进程与工作进程都先完成预热, 首个请求不再付出导入与准备模板的开销
+        convert_md_to_stream('$x$\n', io.BytesIO())
+        self._pool = self._new_pool()
+        for future in [self._pool.submit(time.sleep, 0) for _ in range(self.jobs)]:
+            future.result()
+
+    def serve_forever(self):
+        """接受连接直到 close(); 每个连接一个线程, 可连续发送多个请求"""
+        import socket
+        while not self._stopped.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                if self._stopped.is_set():
+                    break
+                raise
+            conn.settimeout(None)
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def close(self):
+        self._stopped.set()
+        if self._sock is not None:
+            family, addr = _server_address(self.address)
+            self._sock.close()
+            self._sock = None
+            if isinstance(addr, str):
+                Path(addr).unlink(missing_ok=True)
+            server_token_path(self.address).unlink(missing_ok=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def _handle(self, conn):
+        """处理一个连接; 像 HTTP 请求、不是 JSON 对象或令牌不符的行都会关闭连接"""
+        import hmac
+        import json
+        with conn, conn.makefile('rb') as rfile, conn.makefile('wb') as wfile:
+            for line in rfile:
+                if _HTTP_LINE_RE.match(line):
+                    return
+                close = True
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("请求必须是 JSON 对象")
+                    token = request.get('token')
+                    if not isinstance(token, str) or not hmac.compare_digest(token, self._token):
+                        reply = {'ok': False, 'error': "令牌无效"}
+                    else:
+                        close = False
+                        reply = self._dispatch(request)
+                except ValueError as e:
+                    reply = {'ok': False, 'error': f"无效请求: {e}"}
+                try:
+                    wfile.write(json.dumps(reply, ensure_ascii=False).encode('utf-8') + b'\n')
+                    wfile.flush()
+                except OSError:
+                    return  # 客户端已断开
+                if close:
+                    return
+
+    def _dispatch(self, request):
+        if request.get('op') == 'ping':
+            return {'ok': True, 'pid': os.getpid(), 'jobs': self.jobs,
+                    'queue_limit': self.queue_limit, 'active': self._active}
+        if not isinstance(request.get('input'), str) or not request['input']:
+            raise ValueError("缺少 input")
+        output = request.get('output')
+        if output is not None and not isinstance(output, str):
+            raise ValueError("output 必须是路径")
+        _check_output(request['input'], output)
+        if not _same_template(request.get('template')):
+            return {'ok': False, 'refused': '服务使用的模板不同'}
+        if 'latex' in request and request['latex'] != [list(LATEX_OPERATORS), LATEX_MACROS]:
+            return {'ok': False, 'refused': '服务使用的LaTeX配置不同'}
+        if not self._slots.acquire(blocking=False):
+            return {'ok': False, 'refused': '服务繁忙'}
+        with self._lock:
+            self._active += 1
+        try:
+            result = self._run(request['input'], bool(request.get('streaming')),
+                               request.get('output'))
+        finally:
+            with self._lock:
+                self._active -= 1
+            self._slots.release()
+        result['ok'] = result['error'] is None
+        if result['ok']:
+            print(f"{result['input']} -> {result['output']} ({result['time']:.2f}s)", flush=True)
+        else:
+            print(f"{result['input']} 转换出错: {result['error']}", flush=True)
+        return result
+
+    def _run(self, input_file, streaming, output_file):
+        from concurrent.futures.process import BrokenProcessPool
+        pool = self._pool
+        try:
+            return pool.submit(_convert_one, input_file, streaming, output_file).result()
+        except BrokenProcessPool as e:
+            # 工作进程异常退出 (如内存耗尽): 本任务失败, 换一个新的进程池继续服务
+            with self._lock:
+                if self._pool is pool and not self._stopped.is_set():
+                    pool.shutdown(wait=False)
+                    self._pool = self._new_pool()
+            return {'input': str(input_file), 'output': None, 'stats': None,
+                    'error': f"{type(e).__name__}: {e}", 'time': 0.0}
+
+def convert_via_server(input_file, output_file=None, streaming=False, address=None, timeout=None):
+    """把转换交给常驻服务, 返回与批量转换单项相同的结果字典 (含 "ok")
+
+    服务未运行时抛出 OSError; 结果含 "refused" 时服务拒绝了任务。
+    两种情况下调用方都应改为在本进程转换。
+    """
+    import json
+    import socket
+    address = address or default_server_address()
+    family, addr = _server_address(address)
+    # 令牌文件不存在 (服务未运行或属于其他用户) 时抛出 OSError
+    token = server_token_path(address).read_text(encoding='utf-8').strip()
+    request = {'token': token,
+               'input': os.path.abspath(input_file),
+               'output': os.path.abspath(output_file) if output_file else None,
+               'streaming': streaming,
+               'template': os.path.abspath(TEMPLATE_PATH) if TEMPLATE_PATH else None,
+               'latex': [list(LATEX_OPERATORS), LATEX_MACROS]}
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.settimeout(SERVER_CONNECT_TIMEOUT)
+        sock.connect(addr)
+        sock.settimeout(timeout)
+        sock.sendall(json.dumps(request, ensure_ascii=False).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as rfile:
+            line = rfile.readline()
+    if not line:
+        raise ConnectionError("转换服务未返回结果")
+    return json.loads(line)
+
+def run_server(address=None, jobs=None, queue_limit=SERVER_QUEUE_LIMIT):
+    """命令行服务模式: 运行到 Ctrl+C 或 SIGTERM"""
+    import signal
+    server = ConversionServer(address, jobs, queue_limit)
+    try:
+        server.start()
+    except OSError as e:
+        print(f"错误: 无法启动转换服务: {e}")
+        return 1
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"转换服务已启动: {server.address} (进程数 {server.jobs}, 队列上限 {server.queue_limit})",
+          flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+# ===== Async API =====
+# 供 asyncio 服务使用: 转换在线程池或进程池中执行, 不阻塞事件循环; 信号量限制同时
+# 进行的任务数, 多出的任务在 await 处等待 (背压)。线程池中的转换在块之间检查取消标志,
+# 超时或任务被取消时在下一个块之前停止。
+ASYNC_CHUNK_SIZE = 64 * 1024
+
+class ConversionCancelled(Exception):
+    """转换在块之间被取消 (超时或 asyncio 任务被取消)"""
+
+_CANCEL_LOCAL = threading.local()  # 本线程转换的取消标志 (threading.Event)
+
+def _check_cancel(blocks, event):
+    for block in blocks:
+        if event.is_set():
+            raise ConversionCancelled(f"转换已取消 (第 {block.lineno} 行)")
+        yield block
+
+def _convert_to_bytes(source, streaming=False, formula_jobs=None, low_memory=None, cancel=None):
+    """执行器任务: 在内存中转换, 返回 (统计信息, .docx 字节)"""
+    _CANCEL_LOCAL.event = cancel
+    try:
+        buf = io.BytesIO()
+        stats = convert_md_to_stream(source, buf, streaming, formula_jobs, low_memory=low_memory)
+        return stats, buf.getvalue()
+    finally:
+        _CANCEL_LOCAL.event = None
+
+def _convert_file(input_file, output_file=None, streaming=False, formula_jobs=None,
+                  low_memory=None, split=None, cancel=None):
+    """执行器任务: 同 convert_md_to_docx"""
+    _CANCEL_LOCAL.event = cancel
+    try:
+        return convert_md_to_docx(input_file, output_file, streaming, formula_jobs,
+                                  low_memory=low_memory, split=split)
+    finally:
+        _CANCEL_LOCAL.event = None
+
+class AsyncConverter:
+    """asyncio 转换接口: 至多 max_jobs 个任务同时转换, 其余在 await 处排队
+
+    默认在 max_jobs 个线程中转换: 事件循环保持响应, 但受 GIL 限制同一时刻只有一个转换
+    在计算; processes=True 时使用沿用本进程设置的进程池, 多核并行。也可传入自己的
+    executor (此时由调用方关闭)。timeout 为每个任务的默认超时 (秒)。
+    超时或取消时: 线程中的转换在下一个块之前停止; 进程池中尚未开始的任务被撤销,
+    已开始的任务运行到结束, 结果被丢弃。名额在执行器中的任务真正结束时才释放。
+    """
+
+    def __init__(self, max_jobs=None, processes=False, executor=None, timeout=None):
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.max_jobs = max_jobs or os.cpu_count() or 1
+        self.timeout = timeout
+        self.processes = isinstance(executor, ProcessPoolExecutor) if executor else processes
+        self._executor = executor
+        self._own_executor = executor is None
+        self._semaphore = None
+        self.active = 0   # 占用名额的任务数 (含已取消但尚未停止的)
+        self.waiting = 0  # 等待名额的任务数
+
+    def _get_executor(self):
+        if self._executor is None:
+            from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+            if self.processes:
+                cache_path = DISK_CACHE.path if DISK_CACHE is not None else None
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_jobs, initializer=_init_batch_worker,
+                    initargs=(cache_path, FORMULA_CACHE.maxsize, (MATH_PATTERNS, MATH_TRIGGERS),
+                              TEMPLATE_PATH, latex_config()))
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_jobs,
+                                                    thread_name_prefix='md2docx')
+        return self._executor
+
+    async def _run(self, func, args, timeout):
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_jobs)
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        cancel = None if self.processes else threading.Event()
+        try:
+            job = self._get_executor().submit(func, *args, cancel)
+        except BaseException:
+            self._release()
+            raise
+
+        def done(_):
+            try:
+                loop.call_soon_threadsafe(self._release)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+        job.add_done_callback(done)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(job),
+                                          self.timeout if timeout is None else timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if cancel is not None:
+                cancel.set()
+            raise
+
+    def _release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    async def convert(self, source, streaming=False, formula_jobs=None, low_memory=None,
+                      timeout=None):
+        """转换 Markdown (str 或 UTF-8 bytes), 返回 (统计信息, .docx 字节)
+
+        超时抛出 asyncio.TimeoutError; 参数含义同 convert_md_to_stream。
+        """
+        return await self._run(_convert_to_bytes,
+                               (source, streaming, formula_jobs, low_memory), timeout)
+
+    async def stream(self, source, chunk_size=ASYNC_CHUNK_SIZE, **options):
+        """异步生成器: 转换完成后按 chunk_size 字节分块产生 .docx, 可直接写入 HTTP 响应"""
+        _, data = await self.convert(source, **options)
+        view = memoryview(data)
+        for start in range(0, len(view), chunk_size):
+            yield bytes(view[start:start + chunk_size])
+
+    async def convert_file(self, input_file, output_file=None, streaming=False,
+                           formula_jobs=None, low_memory=None, split=None, timeout=None):
+        """转换文件, 返回 (统计信息, 输出路径); 参数含义同 convert_md_to_docx"""
+        return await self._run(_convert_file, (input_file, output_file, streaming,
+                                               formula_jobs, low_memory, split), timeout)
+
+    def close(self, wait=True):
+        """关闭自己创建的执行器"""
+        if self._own_executor and self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close(wait=False)
+
+# ===== Entry Point =====
+def parse_args(argv):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='md2docx', description='Markdown 转 Word, 公式转换为公式编辑器格式')
+    parser.add_argument('inputs', nargs='*', metavar='INPUT',
+                        help='.md 文件、目录或通配符 (多个输入时批量并行转换)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='批量转换或转换服务的进程数 (默认: CPU 核数)')
+    parser.add_argument('--cache', metavar='PATH', nargs='?', const=str(default_cache_path()),
+                        default=os.environ.get('MD2DOCX_CACHE'),
+                        help=f'磁盘公式缓存文件; 不写路径时为 {default_cache_path()} '
+                             '(默认读取环境变量 MD2DOCX_CACHE)')
+    parser.add_argument('--template', metavar='PATH', default=os.environ.get('MD2DOCX_TEMPLATE'),
+                        help='基础模板 .dotx/.docx (默认读取环境变量 MD2DOCX_TEMPLATE)')
+    parser.add_argument('--latex-config', metavar='PATH',
+                        default=os.environ.get('MD2DOCX_LATEX_CONFIG'),
+                        help='自定义运算符名与宏的 JSON 文件 (默认读取环境变量 MD2DOCX_LATEX_CONFIG)')
+    parser.add_argument('--stream', action='store_true',
+                        help='流式写出 document.xml, 大文档内存占用更低')
+    parser.add_argument('--low-memory', action='store_true',
+                        help='低内存模式: mmap 读取输入、流式写出、超长表格分段处理, 报告峰值内存')
+    parser.add_argument('--memory-limit', type=float, default=None, metavar='MB',
+                        help='常驻内存上限 (MB), 超过时转换失败; 隐含 --low-memory')
+    parser.add_argument('--split', type=int, choices=(1, 2), default=None, metavar='LEVEL',
+                        help='拆分输出为多个 .docx: 在 # (1) 或 # 与 ## (2) 标题前开始新部分, 并写出清单')
+    parser.add_argument('--split-blocks', type=int, default=None, metavar='N',
+                        help='拆分输出时每部分最多 N 个块 (可单独使用)')
+    parser.add_argument('--formula-jobs', type=int, default=None, metavar='N',
+                        help='单文件转换时用 N 个进程并行转换公式 (0: CPU 核数)')
+    parser.add_argument('--check', action='store_true',
+                        help='只检查公式能否转换 (不生成文档), 以 JSON 报告失败, 有失败时退出码为1')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='剖析各阶段耗时、最慢的公式与峰值内存, 结果写入 JSON 文件')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='剖析时另用 tracemalloc 统计峰值内存 (转换会明显变慢)')
+    parser.add_argument('--watch', action='store_true',
+                        help='转换后继续监视输入文件, 每次保存后增量重建')
+    parser.add_argument('--serve', action='store_true',
+                        help='作为常驻转换服务运行, 保持依赖、模板与公式缓存预热')
+    parser.add_argument('--client', action='store_true',
+                        help='单文件转换交给常驻服务 (服务未运行时在本进程转换)')
+    parser.add_argument('--address', metavar='ADDR', default=os.environ.get('MD2DOCX_SERVER'),
+                        help='服务地址: Unix socket 路径或 主机:端口 (默认读取环境变量 MD2DOCX_SERVER)')
+    parser.add_argument('--queue', type=int, default=SERVER_QUEUE_LIMIT, metavar='N',
+                        help=f'服务最多排队的任务数 (默认 {SERVER_QUEUE_LIMIT})')
+    args = parser.parse_args(argv)
+    if args.cache and (Path(args.cache).suffix.lower() == '.md' or Path(args.cache).is_dir()):
+        # 不写路径的 --cache 放在输入文件或目录之前时, 输入会被当作缓存路径
+        parser.error(f'缓存路径不能是 .md 文件或目录: {args.cache} '
+                     '(请把 --cache 放在输入之后或写作 --cache=PATH)')
+    if not args.inputs and not args.serve:
+        parser.error('需要指定输入文件')
+    return args
+
+def run_watch(input_file, streaming=False):
+    """命令行监视模式: 每次保存后打印重建结果, 直到 Ctrl+C"""
+    if not input_file.lower().endswith('.md') or not os.path.isfile(input_file):
+        print(f"错误: 不是.md文件或文件不存在: {input_file}")
+        return 1
+
+    def report(result):
+        stamp = time.strftime('%H:%M:%S')
+        if result['error'] is None:
+            stats = result['stats']
+            print(f"[{stamp}] {result['output']} 已更新 (重建 {stats['blocks_rendered']} 块, "
+                  f"复用 {stats['blocks_reused']} 块, {result['time'] * 1000:.0f} ms)", flush=True)
+        else:
+            print(f"[{stamp}] 转换出错: {result['error']}", flush=True)
+
+    print(f"正在监视 {input_file}, 按 Ctrl+C 退出", flush=True)
+    try:
+        watch_file(input_file, streaming=streaming, on_result=report)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def _convert_on_server(input_file, address, streaming):
+    """尝试交给常驻服务转换, 返回 (统计, 输出文件); 服务未运行或拒绝任务时返回 None"""
+    try:
+        result = convert_via_server(input_file, streaming=streaming, address=address)
+    except (OSError, ValueError):
+        return None
+    if result.get('refused'):
+        return None
+    if result['error'] is not None:
+        raise RuntimeError(result['error'])
+    return result['stats'], result['output']
 
+def convert_single(input_file, cli_mode, streaming=False, formula_jobs=None, server=None,
+                   profile_path=None, profile=True, low_memory=None, split=None):
+    """转换单个文件并报告结果 (命令行打印或弹出对话框)
+
+    server 为服务地址时先尝试交给常驻服务转换 (剖析、低内存模式或拆分输出时不交给服务);
+    profile_path 非空时按 profile 剖析本次转换并写入该 JSON 文件。
+    """
     # 检查文件
     if not input_file.lower().endswith('.md'):
         if cli_mode:
             print("错误: 请选择.md文件!")
         else:
             show_result(False, "请选择.md文件!")
-        return
+        return 1
 
     if not os.path.exists(input_file):
         if cli_mode:
             print(f"错误: 文件不存在: {input_file}")
         else:
             show_result(False, f"文件不存在: {input_file}")
-        return
+        return 1
 
     try:
-        stats, output_file = convert_md_to_docx(input_file)
+        if not profile_path:
+            profile = None
+        use_server = server and not profile and not low_memory and not split
+        done = _convert_on_server(input_file, server, streaming) if use_server else None
+        if done is None:
+            done = convert_md_to_docx(input_file, streaming=streaming, formula_jobs=formula_jobs,
+                                      profile=profile, low_memory=low_memory, split=split)
+        stats, output_file = done
         msg = f"转换成功!\n输出文件: {output_file}\n独立公式: {stats['block']}\n行内公式: {stats['inline']}\n总计: {stats['block'] + stats['inline']}"
+        if stats.get('parts'):
+            msg += f"\n拆分为 {len(stats['parts'])} 个部分"
+        if stats.get('peak_rss_bytes'):
+            msg += f"\n峰值内存: {stats['peak_rss_bytes'] / 2**20:.1f} MB"
         if cli_mode:
             print(msg)
         else:
             show_result(True, msg)
+        if profile_path:
+            write_profile(profile_path, {'input': input_file, 'output': str(output_file), 'stats': stats})
+        return 0
     except Exception as e:
         if cli_mode:
             print(f"转换出错: {str(e)}")
@@ -788,6 +3094,83 @@ def main():
             traceback.print_exc()
         else:
             show_result(False, f"转换出错:\n{str(e)}")
+        return 1
+
+def main():
+    """主入口"""
+    # 无参数时为图形界面模式
+    if len(sys.argv) <= 1:
+        try:
+            input_file = select_file()
+        except Exception as e:
+            # 没有安装 Tk 或没有图形显示的环境
+            print(f"无法打开文件选择对话框 ({e})\n用法: python md2docx.py 文件.md")
+            return 1
+        if not input_file:
+            return 0
+        if os.environ.get('MD2DOCX_LATEX_CONFIG'):
+            try:
+                load_latex_config(os.environ['MD2DOCX_LATEX_CONFIG'])
+            except (OSError, ValueError) as e:
+                show_result(False, f"无法读取LaTeX配置: {e}")
+                return 1
+        if os.environ.get('MD2DOCX_CACHE'):
+            warning = try_disk_cache(os.environ['MD2DOCX_CACHE'])
+            if warning:
+                show_warning(warning)
+        if os.environ.get('MD2DOCX_TEMPLATE'):
+            try:
+                set_template(os.environ['MD2DOCX_TEMPLATE'])
+            except FileNotFoundError as e:
+                show_result(False, str(e))
+                return 1
+        return convert_single(input_file, cli_mode=False)
+
+    args = parse_args(sys.argv[1:])
+    if args.latex_config:
+        try:
+            load_latex_config(args.latex_config)
+        except (OSError, ValueError) as e:
+            print(f"错误: 无法读取LaTeX配置: {e}")
+            return 1
+    if args.cache:
+        warning = try_disk_cache(args.cache)
+        if warning:
+            print(f"警告: {warning}")
+    if args.template:
+        try:
+            set_template(args.template)
+        except FileNotFoundError as e:
+            print(f"错误: {e}")
+            return 1
+
+    profile = {'memory': True} if args.profile_memory else True
+    low_memory = int(args.memory_limit * 2**20) if args.memory_limit else args.low_memory
+    split = None
+    if args.split or args.split_blocks:
+        split = SplitRule(heading=args.split or 0, max_blocks=args.split_blocks)
+    if args.check:
+        return run_check(args.inputs, args.jobs)
+    if args.serve:
+        return run_server(args.address, args.jobs, args.queue)
+    if args.watch:
+        if len(args.inputs) != 1:
+            print("错误: --watch 只能监视一个文件")
+            return 1
+        if low_memory or split:
+            print("错误: --watch 不能与低内存模式或拆分输出同时使用")
+            return 1
+        return run_watch(args.inputs[0], args.stream)
+    if len(args.inputs) == 1 and not os.path.isdir(args.inputs[0]) and not glob.has_magic(args.inputs[0]):
+        server = (args.address or default_server_address()) if args.client else None
+        return convert_single(args.inputs[0], cli_mode=True, streaming=args.stream,
+                              formula_jobs=args.formula_jobs, server=server,
+                              profile_path=args.profile, profile=profile, low_memory=low_memory,
+                              split=split)
+    return run_batch(args.inputs, args.jobs, args.stream, args.profile, profile, low_memory, split)
 
 if __name__ == '__main__':
-    main()
+    # 打包后的 Windows exe 中, 进程池的工作进程启动时在这里接管, 不会再次运行 main()
+    import multiprocessing
+    multiprocessing.freeze_support()
+    sys.exit(main())